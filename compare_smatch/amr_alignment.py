@@ -13,6 +13,21 @@ from collections import defaultdict
 from pynlpl.formats.giza import GizaSentenceAlignment
 import re
 
+from smatch.amr import LABELS
+
+label_ids = LABELS.ids  # case-folded label ids, shared with the AMR parser
+
+def lower_label_class(label):
+  """ Labels of different classes never match (see smatch.compute_pool) """
+  return LABELS.label_id(label)
+
+
+def xlang_edge_label_class(label):
+  """ Like lower_label_class, but all op edges are in one class """
+  label = label.lower()
+  return "op" if label.startswith("op") else label
+
+
 class Amr2AmrAligner(object):
   def __init__(self, num_best=5, num_best_in_file=-1, src2tgt_fh=None, tgt2src_fh=None):
     if src2tgt_fh == None or tgt2src_fh == None:
@@ -56,7 +71,7 @@ class Amr2AmrAligner(object):
     self.amr2amr = defaultdict(float)
     for (tgt_lbl, tgt_scores) in amr2sent_tgt.items():
       for (src_lbl, src_scores) in amr2sent_src.items():
-        if src_lbl.lower() == tgt_lbl.lower():
+        if LABELS.label_id(src_lbl) == LABELS.label_id(tgt_lbl):
           self.amr2amr[(tgt_lbl, src_lbl)] += 1.0
           continue
         for (t, t_score) in enumerate(tgt_scores):
@@ -77,14 +92,24 @@ class Amr2AmrAligner(object):
     return sorted(const_matches, key=lambda x: self.node_weight_fn(const, x), reverse=True)
 
 
-  @staticmethod
   def dflt_node_weight_fn(tgt_label, src_label):
-    return 1.0 if tgt_label.lower() == src_label.lower() else 0.0
+    try:
+      same = label_ids[tgt_label] == label_ids[src_label]
+    except KeyError: # not seen by the parser
+      same = LABELS.label_id(tgt_label) == LABELS.label_id(src_label)
+    return 1.0 if same else 0.0
+  dflt_node_weight_fn.label_class = lower_label_class
+  dflt_node_weight_fn = staticmethod(dflt_node_weight_fn)
 
 
-  @staticmethod
   def dflt_edge_weight_fn(tgt_label, src_label):
-    return 1.0 if tgt_label.lower() == src_label.lower() else 0.0
+    try:
+      same = label_ids[tgt_label] == label_ids[src_label]
+    except KeyError: # not seen by the parser
+      same = LABELS.label_id(tgt_label) == LABELS.label_id(src_label)
+    return 1.0 if same else 0.0
+  dflt_edge_weight_fn.label_class = lower_label_class
+  dflt_edge_weight_fn = staticmethod(dflt_edge_weight_fn)
 
 
   def xlang_edge_weight_fn(self, tgt_label, src_label):
@@ -97,6 +122,15 @@ class Amr2AmrAligner(object):
     if tgt.startswith("op") and src.startswith("op"):
       return 0.9 # TODO this is a frumious hack to favor similar op edges
     return 0.0
+  xlang_edge_weight_fn.label_class = xlang_edge_label_class
+
+
+  def skip_amrs(self):
+    """ Skip the n-best alignments that set_amrs would read for an AMR pair. """
+    if self.is_default:
+      return
+    self.get_nbest_alignments(self.src2tgt_fh)
+    self.get_nbest_alignments(self.tgt2src_fh)
 
 
   def get_nbest_alignments(self, fh):
@@ -141,10 +175,7 @@ class Amr2AmrAligner(object):
 default_aligner = Amr2AmrAligner()
 
 def get_all_labels(amr):
-  ret = [v for v in amr.var_values]
-  for l in amr.const_links:
-    ret += [v for (k,v) in l.items()]
-  return ret
+  return amr.var_values + amr.const_value
 
 
 def align_amr2sent_dflt(amr, sent):
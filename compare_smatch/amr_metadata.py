@@ -8,56 +8,110 @@ Copyright(c) 2014
 Read AMR file in while also processing metadata in comments
 """
 
+import codecs
 import re
 
+from smatch import amr_cache
 from smatch.amr import AMR
 
 class AmrMeta(AMR):
+  __slots__ = ('metadata',)
+
   def __init__(self, var_list=None, var_value_list=None,
                link_list=None, const_link_list=None, path2label=None,
-               base_amr=None, metadata={}):
+               base_amr=None, metadata=None):
     if base_amr is None:
       super(AmrMeta, self).__init__(var_list, var_value_list,
                                     link_list, const_link_list, path2label)
     else:
-      self.nodes = base_amr.nodes
-      self.root = base_amr.root
-      self.var_values = base_amr.var_values
-      self.links = base_amr.links
-      self.const_links = base_amr.const_links
-      self.path2label = base_amr.path2label
+      # share the lists of the parsed AMR
+      for name in AMR.__slots__:
+        setattr(self, name, getattr(base_amr, name))
 
+    if metadata is None:
+      metadata = {}
     self.metadata = metadata
 
 
   @classmethod
-  def from_parse(cls, annotation_line, comment_lines, consts_to_vars=False):
-    metadata = {}
-    for l in comment_lines:
-      matches = re.findall(r'::(\S+)\s(([^:]|:(?!:))+)', l)
-      for m in matches:
-        metadata[m[0]] = m[1].strip()
+  def from_amr(cls, base_amr, comment_lines):
+    return cls(base_amr=base_amr, metadata=parse_metadata(comment_lines))
+
 
+  @classmethod
+  def from_parse(cls, annotation_line, comment_lines, consts_to_vars=False):
     base_amr = AMR.parse_AMR_line(annotation_line, consts_to_vars=consts_to_vars)
-    return cls(base_amr=base_amr, metadata=metadata)
-
-
-def get_amr_line(infile):
-  """ Read an entry from the input file. AMRs are separated by blank lines. """
-  cur_comments = []
-  cur_amr = []
-  has_content = False
-  for line in infile:
-    if line[0] == "(" and len(cur_amr) != 0:
-      cur_amr = []
-    if line.strip() == "":
-      if not has_content:
-        continue
-      else:
+    return cls.from_amr(base_amr, comment_lines)
+
+
+def parse_metadata(comment_lines):
+  """ Dict of the ::key value fields in the comment lines of an entry. """
+  metadata = {}
+  for l in comment_lines:
+    matches = re.findall(r'::(\S+)\s(([^:]|:(?!:))+)', l)
+    for m in matches:
+      metadata[m[0]] = m[1].strip()
+  return metadata
+
+
+# read an entry from the input file, as (AMR line, comment lines)
+get_amr_line = amr_cache.get_amr_entry
+
+
+def offset_lines(infile, offset):
+  """ Decoded lines of a file opened in binary mode, keeping offset[0] at the
+  byte offset just past the last line read. """
+  for line in iter(infile.readline, ''):
+    offset[0] += len(line)
+    yield line.decode('utf8')
+
+
+def index_amrs(path):
+  """ Index the entries of the AMR file at path without parsing them.
+  Returns list of (byte offset, ::id, ::annotator) of each entry, with None
+  for missing metadata. """
+  index = []
+  offset = [0]
+  with open(path, 'rb') as infile:
+    lines = offset_lines(infile, offset)
+    while True:
+      start = offset[0]
+      (amr_line, comments) = get_amr_line(lines)
+      if amr_line == "":
         break
-    elif line.strip().startswith("#"):
-      cur_comments.append(line.strip())
-    else:
-      has_content = True
-      cur_amr.append(line.strip())
-  return ("".join(cur_amr), cur_comments)
+      metadata = parse_metadata(comments)
+      index.append((start, metadata.get('id'), metadata.get('annotator')))
+  return index
+
+
+def read_amrs(path, consts_to_vars=False, cache=False, entries=None,
+              index=None):
+  """ Read and parse each entry of the AMR file at path as an AmrMeta. With
+  cache, the parsed entries come from the amr_cache file of path instead.
+  Given entries, a list of entry numbers, only those entries are read, in that
+  order, seeking to each through index (see index_amrs). """
+  if cache:
+    records = amr_cache.load_amrs(path, consts_to_vars)
+    try:
+      if entries is None:
+        entries = xrange(len(records))
+      for i in entries:
+        yield AmrMeta.from_amr(*records[i])
+    finally:
+      records.close()
+    return
+  if entries is not None:
+    if index is None:
+      index = index_amrs(path)
+    with open(path, 'rb') as infile:
+      for i in entries:
+        infile.seek(index[i][0])
+        (amr_line, comments) = get_amr_line(offset_lines(infile, [0]))
+        yield AmrMeta.from_parse(amr_line, comments, consts_to_vars=consts_to_vars)
+    return
+  with codecs.open(path, encoding='utf8') as infile:
+    while True:
+      (amr_line, comments) = get_amr_line(infile)
+      if amr_line == "":
+        break
+      yield AmrMeta.from_parse(amr_line, comments, consts_to_vars=consts_to_vars)
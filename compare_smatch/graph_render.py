@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+graph_render.py
+
+Renders disagreement graphs to image files with graphviz. Graphs are handed
+over as DOT text with their output path, so that the layout and drawing,
+the slowest step per sentence, can run in a pool of worker processes.
+
+Run as a script, it renders DOT files written by disagree.py --no-render:
+
+  python compare_smatch/graph_render.py [--format png] [--outdir DIR] FILE.dot ...
+"""
+
+import argparse
+from collections import deque
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+
+import networkx as nx
+import pygraphviz as pgz
+
+PENDING_PER_JOB = 8  # renderings queued per worker before render waits
+MANIFEST = 'manifest.json'  # output file -> cached image, in a render cache
+
+
+def graph2dot(g, label):
+  """ DOT text of a disagreement graph, with label as its caption """
+  ag = nx.drawing.nx_agraph.to_agraph(g)
+  ag.graph_attr['label'] = label
+  return ag.string()
+
+
+def render_dot(job):
+  """
+  Lay out and draw DOT text.
+  Input:
+    job: (DOT text, output path, graphviz layout program)
+  Returns (output path, None), or (output path, error message) if graphviz
+  failed.
+  """
+  (dot, path, layout) = job
+  try:
+    ag = pgz.AGraph(string=dot)
+    ag.layout(prog=layout)
+    ag.draw(path)
+  except Exception as e:
+    return (path, str(e) or e.__class__.__name__)
+  return (path, None)
+
+
+def render_cached(job):
+  """
+  Render DOT text into a render cache, then copy the image to its output path.
+  Input:
+    job: (DOT text, output path, graphviz layout program, cache file)
+  Returns as render_dot.
+  """
+  (dot, path, layout, cache_file) = job
+  # draw under a temporary name with the same extension, so that a failed
+  # or concurrent rendering never leaves a partial image in the cache
+  tmp_file = os.path.join(os.path.dirname(cache_file),
+                          'tmp-%d-%s' % (os.getpid(), os.path.basename(cache_file)))
+  (tmp_file, error) = render_dot((dot, tmp_file, layout))
+  if error is not None:
+    if os.path.exists(tmp_file):
+      os.remove(tmp_file)
+    return (path, error)
+  try:
+    os.rename(tmp_file, cache_file)
+    shutil.copyfile(cache_file, path)
+  except (IOError, OSError) as e:
+    return (path, str(e))
+  return (path, None)
+
+
+def render_key(dot, layout, extension):
+  """ Name of the cached image of DOT text, from a hash of what it depends on """
+  if isinstance(dot, unicode):
+    dot = dot.encode('utf8')
+  digest = hashlib.sha1('%s\0%s\0' % (layout, extension))
+  digest.update(dot)
+  return '%s.%s' % (digest.hexdigest(), extension)
+
+
+def copy_cached(cache_file, path):
+  """ Copy a cached image to its output path, returning as render_dot """
+  try:
+    shutil.copyfile(cache_file, path)
+  except (IOError, OSError) as e:
+    return (path, str(e))
+  return (path, None)
+
+
+def write_dot(job):
+  """ Write the DOT text of a job as it is, without layout, as render_dot """
+  (dot, path, layout) = job
+  if isinstance(dot, unicode):
+    dot = dot.encode('utf8')
+  try:
+    with open(path, 'wb') as out:
+      out.write(dot)
+  except IOError as e:
+    return (path, str(e))
+  return (path, None)
+
+
+class GraphRenderer(object):
+  """
+  Renders DOT text to image files of the given extension (which sets the
+  graphviz output format) in a pool of worker processes, or in this process
+  when jobs is 1. jobs 0 starts one worker per core. With layout None, the
+  DOT text is written to .dot files instead, without layout. Each file that
+  fails to render is reported on stderr and listed in failures.
+
+  Given a cache_dir, images are kept there under a hash of their DOT text,
+  layout and extension, and only graphs not rendered before are laid out;
+  the others are copied from the cache. The MANIFEST file of cache_dir maps
+  each output file to its cached image.
+  """
+
+  def __init__(self, layout='dot', jobs=1, extension='png', cache_dir=None):
+    self.layout = layout
+    self.render_fn = render_dot
+    self.extension = extension
+    if layout is None:
+      (self.render_fn, self.extension, jobs, cache_dir) = (write_dot, 'dot', 1, None)
+    self.cache_dir = cache_dir
+    if cache_dir is not None:
+      self.render_fn = render_cached
+      self.manifest = {}
+      if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+      elif os.path.exists(os.path.join(cache_dir, MANIFEST)):
+        with open(os.path.join(cache_dir, MANIFEST)) as f:
+          self.manifest = json.load(f)
+    self.pool = None
+    if jobs != 1:
+      self.pool = multiprocessing.Pool(jobs or None)
+      self.max_pending = PENDING_PER_JOB * (jobs or multiprocessing.cpu_count())
+    self.pending = deque()
+    self.failures = []
+
+  def render(self, dot, path):
+    """ Queue the rendering of DOT text to path """
+    job = (dot, path, self.layout)
+    if self.cache_dir is not None:
+      key = render_key(dot, self.layout, self.extension)
+      cache_file = os.path.join(self.cache_dir, key)
+      self.manifest[os.path.abspath(path)] = key
+      if os.path.exists(cache_file):
+        self.report(copy_cached(cache_file, path))
+        return
+      job = (dot, path, self.layout, cache_file)
+    if self.pool is None:
+      self.report(self.render_fn(job))
+      return
+    self.pending.append(self.pool.apply_async(self.render_fn, (job,)))
+    while len(self.pending) > self.max_pending:
+      self.report(self.pending.popleft().get())
+
+  def report(self, result):
+    (path, error) = result
+    if error is not None:
+      print >> sys.stderr, "Error: could not render %s: %s" % (path, error)
+      self.failures.append(path)
+      if self.cache_dir is not None:
+        self.manifest.pop(os.path.abspath(path), None)
+
+  def close(self):
+    """ Wait for the queued renderings and stop the workers """
+    while self.pending:
+      self.report(self.pending.popleft().get())
+    if self.pool is not None:
+      self.pool.close()
+      self.pool.join()
+      self.pool = None
+    if self.cache_dir is not None:
+      manifest_file = os.path.join(self.cache_dir, MANIFEST)
+      with open(manifest_file + '.tmp', 'w') as out:
+        json.dump(self.manifest, out, indent=1, sort_keys=True)
+      os.rename(manifest_file + '.tmp', manifest_file)
+
+
+def main(args):
+  renderer = GraphRenderer(args.layout, args.render_jobs, args.format,
+                           args.render_cache)
+  for dot_file in args.dot_files:
+    with open(dot_file, 'rb') as f:
+      dot = f.read()
+    outdir = args.outdir or os.path.dirname(dot_file) or '.'
+    name = os.path.splitext(os.path.basename(dot_file))[0]
+    renderer.render(dot, '%s/%s.%s' % (outdir, name, args.format))
+  renderer.close()
+  return 1 if renderer.failures else 0
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Render DOT files written by disagree.py --no-render')
+  parser.add_argument('dot_files', nargs='+', help='DOT files to render')
+  parser.add_argument('-o', '--outdir',
+    help='Image output directory (default: next to each DOT file)')
+  parser.add_argument('--format', default='png',
+    help='Graphviz output format, used as the file extension')
+  parser.add_argument('--layout', default='dot',
+    help='Graphviz output layout')
+  parser.add_argument('--render_jobs', type=int, default=1,
+    help='Number of processes laying out and drawing the graphs, 0 for one per core')
+  parser.add_argument('--render_cache',
+    help='Directory of previously rendered images, to reuse for unchanged graphs')
+  args = parser.parse_args()
+  if args.outdir and not os.path.exists(args.outdir):
+    os.makedirs(args.outdir)
+  sys.exit(main(args))
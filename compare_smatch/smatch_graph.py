@@ -28,7 +28,7 @@ class SmatchGraph:
     match, const_map_fn=default_aligner.const_map_fn):
     """
     Input:
-      (inst, rel1, rel2) from test amr.get_triples2()
+      (inst, rel1, rel2) from test amr.get_indexed_triples()
       (gold_inst_t, gold_rel1_t, gold_rel2_t) from gold amr2dict()
       match from smatch
       const_map_fn returns a sorted list of gold label matches for a test label input
@@ -52,13 +52,13 @@ class SmatchGraph:
     """
 
     for (ind, (i, v, instof)) in enumerate(self.inst):
-      self.add_inst(ind, v, instof)
+      self.add_inst(ind, node_id(v), instof)
 
     for (reln, v, const) in self.rel1:
-      self.add_rel1(reln, v, const)
+      self.add_rel1(reln, node_id(v), const)
 
     for (reln, v1, v2) in self.rel2:
-      self.add_rel2(reln, v1, v2)
+      self.add_rel2(reln, node_id(v1), node_id(v2))
 
     if node_weight_fn and edge_weight_fn:
       self.unmatch_dead_nodes(node_weight_fn, edge_weight_fn)
@@ -194,24 +194,30 @@ class SmatchGraph:
         del self.gold_ind[v]
 
 
+def node_id(var):
+  """ Graph node name of a test variable index, as rename_node would name it """
+  return u'a%d' % var
+
+
 def amr2dict(inst, rel1, rel2):
-  """ Get tables of AMR data indexed by variable number """
-  node_inds = {}
+  """
+  Get tables of AMR data indexed by variable number, from the triples of
+  amr.get_indexed_triples()
+  """
   inst_t = {}
-  for (ind, (i, v, label)) in enumerate(inst):
-    node_inds[v] = ind
-    inst_t[ind] = label
+  for (i, v, label) in inst:
+    inst_t[v] = label
 
   rel1_t = {}
   for (label, v1, const) in rel1:
-    if (node_inds[v1], const) not in rel1_t:
-      rel1_t[(node_inds[v1], const)] = set()
-    rel1_t[(node_inds[v1], const)].add(label)
+    if (v1, const) not in rel1_t:
+      rel1_t[(v1, const)] = set()
+    rel1_t[(v1, const)].add(label)
 
   rel2_t = {}
   for (label, v1, v2) in rel2:
-    if (node_inds[v1], node_inds[v2]) not in rel2_t:
-      rel2_t[(node_inds[v1], node_inds[v2])] = set()
-    rel2_t[(node_inds[v1], node_inds[v2])].add(label)
+    if (v1, v2) not in rel2_t:
+      rel2_t[(v1, v2)] = set()
+    rel2_t[(v1, v2)].add(label)
 
   return (inst_t, rel1_t, rel2_t)
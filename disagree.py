@@ -27,52 +27,63 @@ AMR-sentence alignment.
 import argparse
 import argparse_config
 import codecs
-import networkx as nx
+from collections import deque
+import itertools
 from networkx.readwrite import json_graph
 import os
 import pygraphviz as pgz
+import sys
 
 # internal libraries
 from compare_smatch import amr_metadata
+from compare_smatch import graph_render
 from compare_smatch import smatch_graph
 from compare_smatch.amr_alignment import Amr2AmrAligner
 from compare_smatch.amr_alignment import default_aligner
+from compare_smatch.graph_render import GraphRenderer
 from compare_smatch.smatch_graph import SmatchGraph
 from smatch import smatch
 
 cur_sent_id = 0
+SENTENCES_PER_JOB = 4  # sentences queued per alignment worker
 
-def hilight_disagreement(test_amrs, gold_amr, iter_num, aligner=default_aligner, gold_aligned_fh=None):
+def hilight_disagreement(test_amrs, gold_amr, iter_num, aligner=default_aligner, gold_alignments=None, search_stats=None, **search_opts):
   """
   Input:
     test_amrs: list of AMRs to compare to
     gold_amr: gold AMR object
     iter_num: Number of random restarts to use in smatch algorithm.
+    gold_alignments: if given, the alignment of each test AMR to use instead
+      of running smatch, as from get_next_gold_alignments
+    search_stats: if given, a list to append the smatch.get_fh stats of each pair to
+    search_opts: further keyword arguments to smatch.get_fh
   Returns list of disagreement graphs for each gold-test AMR pair.
   """
 
   smatchgraphs = []
-  gold_label=u'b'
-  gold_amr.rename_node(gold_label)
-  (gold_inst, gold_rel1, gold_rel2) = gold_amr.get_triples2()
+  (gold_inst, gold_rel1, gold_rel2) = gold_amr.get_indexed_triples()
   (gold_inst_t, gold_rel1_t, gold_rel2_t) = smatch_graph.amr2dict(gold_inst, gold_rel1, gold_rel2)
   # TODO Also compute the weight score if we read gold alignments in from file
   # TODO This would require me to handle constants when we read from file
 
-  for a in test_amrs:
+  for (ind, a) in enumerate(test_amrs):
     aligner.set_amrs(a, gold_amr)
-    test_label=u'a'
-    a.rename_node(test_label)
-    (test_inst, test_rel1, test_rel2) = a.get_triples2()
-    if gold_aligned_fh:
-      best_match = get_next_gold_alignments(gold_aligned_fh)
+    (test_inst, test_rel1, test_rel2) = a.get_indexed_triples()
+    stats = {'iterations': 0}
+    if gold_alignments is not None:
+      best_match = gold_alignments[ind]
       best_match_num = -1.0
     else:
       (best_match, best_match_num) = smatch.get_fh(test_inst, test_rel1, test_rel2,
         gold_inst, gold_rel1, gold_rel2,
-        test_label, gold_label,
+        None, None,
         node_weight_fn=aligner.node_weight_fn, edge_weight_fn=aligner.edge_weight_fn,
-        iter_num=iter_num)
+        iter_num=iter_num, stats=stats, **search_opts)
+    if stats.get('truncated'):
+      sys.stderr.write("Warning: alignment of %s to %s ran out of its time budget\n" %
+                       (a.metadata.get('id', ''), gold_amr.metadata.get('id', '')))
+    if search_stats is not None:
+      search_stats.append(stats)
 
     disagreement = SmatchGraph(test_inst, test_rel1, test_rel2, \
       gold_inst_t, gold_rel1_t, gold_rel2_t, \
@@ -81,6 +92,99 @@ def hilight_disagreement(test_amrs, gold_amr, iter_num, aligner=default_aligner,
   return smatchgraphs
 
 
+def single_view(amr):
+  """
+  Disagreement graph entry of a lone AMR, matched to itself without running
+  smatch, so that it is drawn in the default color.
+  Returns (SmatchGraph, score) as an entry of hilight_disagreement.
+  """
+  (inst, rel1, rel2) = amr.get_indexed_triples()
+  (inst_t, rel1_t, rel2_t) = smatch_graph.amr2dict(inst, rel1, rel2)
+  match = range(len(inst))
+  return (SmatchGraph(inst, rel1, rel2, inst_t, rel1_t, rel2_t, match),
+          len(inst) + len(rel1) + len(rel2))
+
+
+def alignment_score(test_amr, gold_amr, match):
+  """ Match number of a given alignment of test_amr to gold_amr, as from
+  get_next_gold_alignments """
+  (candidate_match, weight_dict) = smatch.compute_pool(
+    *(test_amr.get_indexed_triples() + gold_amr.get_indexed_triples() +
+      (None, None, default_aligner.node_weight_fn, default_aligner.edge_weight_fn)))
+  return smatch.compute_match(match, weight_dict)
+
+
+def score_pairs(amrs, gold_scores, iter_num, **search_opts):
+  """
+  Smatch counts of every pair of annotations of a sentence. The first AMR
+  was already aligned to each other one, so only the pairs of the others are
+  searched, with the triples of each AMR computed once for all of its pairs.
+  Input:
+    amrs: list of AMRs of the sentence, the gold AMR first
+    gold_scores: match number of the gold AMR with each of amrs[1:]
+    iter_num: Number of random restarts to use in smatch algorithm.
+    search_opts: further keyword arguments to smatch.get_fh
+  Returns list of (i, j, match number, triple number of AMR i, triple number
+  of AMR j) for each pair of positions i < j in amrs.
+  """
+  triples = [a.get_indexed_triples() for a in amrs]
+  sizes = [len(inst) + len(rel1) + len(rel2) for (inst, rel1, rel2) in triples]
+  scores = [(0, j, match_num, sizes[0], sizes[j])
+            for (j, match_num) in enumerate(gold_scores, 1)]
+  for (i, j) in itertools.combinations(range(1, len(amrs)), 2):
+    (first, second) = (i, j)
+    # as smatch.py, search from the AMR with fewer variables
+    if len(triples[j][0]) < len(triples[i][0]):
+      (first, second) = (j, i)
+    stats = {}
+    (best_match, best_match_num) = smatch.get_fh(
+      *(triples[first] + triples[second] + (None, None)),
+      iter_num=iter_num, stats=stats, **search_opts)
+    if stats.get('truncated'):
+      sys.stderr.write("Warning: scoring of annotations %d and %d of %s ran out of its time budget\n" %
+                       (i, j, amrs[0].metadata.get('id', '')))
+    scores.append((i, j, best_match_num, sizes[i], sizes[j]))
+  return scores
+
+
+def annotator_labels(amrs):
+  """ Row and column label of each annotation of a sentence in an agreement
+  matrix: its annotator, or its position if it has none or shares it. """
+  names = [a.metadata.get('annotator') or str(ind) for (ind, a) in enumerate(amrs)]
+  return [name if names.count(name) == 1 else '%s.%d' % (name, ind)
+          for (ind, name) in enumerate(names)]
+
+
+def add_pair_counts(counts, labels, pair_scores):
+  """ Add the counts of score_pairs to counts, a dict of (label, label), in
+  sorted order, to [match number, triple number, triple number] """
+  for (i, j, match_num, num_i, num_j) in pair_scores:
+    (a, b) = (labels[i], labels[j])
+    if b < a:
+      (a, b, num_i, num_j) = (b, a, num_j, num_i)
+    total = counts.setdefault((a, b), [0, 0, 0])
+    total[0] += match_num
+    total[1] += num_i
+    total[2] += num_j
+
+
+def write_agreement(fh, title, labels, counts):
+  """ Write a tab-separated matrix of the Smatch F-score of each pair of
+  labels in counts (see add_pair_counts), under a '# title' line. """
+  fh.write('# %s\n' % title)
+  fh.write('\t' + '\t'.join(labels) + '\n')
+  for a in labels:
+    cells = []
+    for b in labels:
+      total = counts.get((min(a, b), max(a, b)))
+      if total is None:
+        cells.append('-')
+      else:
+        cells.append('%.4f' % smatch.compute_f(*total)[2])
+    fh.write(a + '\t' + '\t'.join(cells) + '\n')
+  fh.write('\n')
+
+
 def get_disagreement_graphs(smatchgraphs, aligner=default_aligner,
                             unmatch_dead_nodes=True):
   if unmatch_dead_nodes:
@@ -92,6 +196,14 @@ def get_disagreement_graphs(smatchgraphs, aligner=default_aligner,
     return [(g.smatch2graph(), score) for (g, score) in smatchgraphs]
 
 
+def get_renderer(args):
+  """ GraphRenderer for the images, or for DOT files with --no-render """
+  if args.no_render:
+    return GraphRenderer(layout=None)
+  return GraphRenderer(args.layout, args.render_jobs,
+                       cache_dir=args.render_cache)
+
+
 def open_output_files(args):
   json_fh = None
   if args.json_out:
@@ -124,6 +236,14 @@ def get_next_gold_alignments(gold_aligned_fh):
   return [v for (k, v) in sorted(match_hash.items())]
 
 
+def get_search_opts(args):
+  """ Keyword arguments to smatch.get_fh from the command line flags """
+  return {'jobs': args.restart_jobs, 'exact_limit': args.exact_limit,
+          'patience': args.patience, 'min_iter': args.min_restarts + 1,
+          'time_limit': args.restart_time, 'time_budget': args.time_budget,
+          'init': args.init, 'search': args.search, 'max_evals': args.max_evals}
+
+
 def get_sent_info(metadata, dflt_id=None):
   """ Return ID, sentence if available, and change metadata to reflect """
   (sent_id, sent) = (None, None)
@@ -147,78 +267,295 @@ def get_sent_info(metadata, dflt_id=None):
   return (sent_id, sent)
 
 
-def monolingual_main(args):
-  """ Disagreement graphs for different annotations of a single sentence. """
-  infile = codecs.open(args.infile, encoding='utf8')
-  gold_aligned_fh = None
-  if args.align_in:
-    gold_aligned_fh = codecs.open(args.align_in, encoding='utf8')
-  (json_fh, align_fh) = open_output_files(args)
+def parse_range(text):
+  """ START:END sentence range from the command line, either end optional """
+  (start, sep, end) = text.partition(':')
+  try:
+    if not sep:
+      raise ValueError
+    return (int(start) if start else None, int(end) if end else None)
+  except ValueError:
+    raise argparse.ArgumentTypeError("expected START:END, not %r" % text)
+
+
+def skip_gold_alignments(gold_aligned_fh, num_pairs):
+  """ Skip the alignments of num_pairs AMR pairs in an --align_in file """
+  for i in range(num_pairs):
+    get_next_gold_alignments(gold_aligned_fh)
+
 
+def group_sentences(amrs, singleview=False):
+  """ Group consecutive AMRs with the same ::id, or each AMR alone with
+  singleview. Returns generator of (sentence id, list of AMRs). """
   amrs_same_sent = []
   cur_id = ""
-  while True:
-    (amr_line, comments) = amr_metadata.get_amr_line(infile)
-    cur_amr = None
-    if amr_line:
-      cur_amr = amr_metadata.AmrMeta.from_parse(amr_line, comments,
-      consts_to_vars=(gold_aligned_fh != None or align_fh != None))
+  for cur_amr in amrs:
+    (sent_id, sent) = get_sent_info(cur_amr.metadata)
+    if 'annotator' not in cur_amr.metadata:
+      cur_amr.metadata['annotator'] = ''
+    if len(amrs_same_sent) and (cur_id != sent_id or singleview):
+      yield (cur_id, amrs_same_sent)
+      amrs_same_sent = []
+    cur_id = sent_id
+    amrs_same_sent.append(cur_amr)
+  if len(amrs_same_sent):
+    yield (cur_id, amrs_same_sent)
+
+
+def index_sentences(index, singleview=False):
+  """ Group the entries of an AMR file index (see amr_metadata.index_amrs) as
+  group_sentences groups the AMRs, numbering entries without an ::id as
+  get_sent_info does. Returns list of (sentence id, entry numbers). """
+  sentences = []
+  num_unnamed = 0
+  for (i, (offset, sent_id, annotator)) in enumerate(index):
+    if sent_id is None:
+      sent_id = "%d" % num_unnamed
+      num_unnamed += 1
+    if len(sentences) and sentences[-1][0] == sent_id and not singleview:
+      sentences[-1][1].append(i)
+    else:
+      sentences.append((sent_id, [i]))
+  return sentences
+
+
+def choose_sentences(sent_ids, args):
+  """ Positions of the sentences chosen with --range and --ids """
+  chosen = range(len(sent_ids))
+  if args.range:
+    chosen = chosen[slice(*args.range)]
+  if args.ids:
+    ids = set(args.ids)
+    chosen = [n for n in chosen if sent_ids[n] in ids]
+    for missing in ids.difference(sent_ids[n] for n in chosen):
+      sys.stderr.write("Warning: no sentence with ::id %s was chosen\n" % missing)
+  return chosen
+
+
+def select_sentences(args, consts_to_vars, gold_aligned_fh=None):
+  """ Read the sentences of args.infile chosen with --ids and --range, seeking
+  to them through an index of the file. Returns generator of (sentence id,
+  list of AMRs), as group_sentences. """
+  index = amr_metadata.index_amrs(args.infile)
+  sentences = index_sentences(index, args.singleview)
+  chosen = choose_sentences([sent_id for (sent_id, entries) in sentences], args)
+  amrs = amr_metadata.read_amrs(args.infile, consts_to_vars=consts_to_vars,
+    cache=args.cache, entries=[i for n in chosen for i in sentences[n][1]],
+    index=index)
+  next_sent = 0
+  for n in chosen:
+    if gold_aligned_fh:
+      # one alignment per test AMR, or for the AMR itself if it is alone
+      skip_gold_alignments(gold_aligned_fh, sum(max(len(entries) - 1, 1)
+        for (sent_id, entries) in sentences[next_sent:n]))
+    next_sent = n + 1
+    (sent_id, entries) = sentences[n]
+    amrs_same_sent = list(itertools.islice(amrs, len(entries)))
+    for cur_amr in amrs_same_sent:
+      cur_amr.metadata.setdefault('id', sent_id)
       get_sent_info(cur_amr.metadata)
       if 'annotator' not in cur_amr.metadata:
         cur_amr.metadata['annotator'] = ''
-      if not cur_id:
-        cur_id = cur_amr.metadata['id']
-
-    if cur_amr is None or cur_id != cur_amr.metadata['id'] or (args.singleview and len(amrs_same_sent)):
-      gold_amr = amrs_same_sent[0]
-      test_amrs = amrs_same_sent[1:]
-      if len(test_amrs) == 0:
-        test_amrs = [gold_amr] # single AMR view case
-        args.num_restarts = 1 # TODO make single AMR view more efficient
-      smatchgraphs = hilight_disagreement(test_amrs, gold_amr,
-        args.num_restarts, gold_aligned_fh=gold_aligned_fh)
-      amr_graphs = get_disagreement_graphs(smatchgraphs, unmatch_dead_nodes=(gold_aligned_fh == None))
-      gold_anno = gold_amr.metadata['annotator']
-      sent = gold_amr.metadata['tok']
+    yield (sent_id, amrs_same_sent)
+
+
+def select_pairs(args, aligner, gold_aligned_fh=None):
+  """ Read the AMR pairs of args.src_amr and args.tgt_amr chosen with --ids
+  and --range, seeking to them through indexes of the files, and skip the
+  alignments of the others. Returns generator of (source AMR, target AMR). """
+  src_index = amr_metadata.index_amrs(args.src_amr)
+  tgt_index = amr_metadata.index_amrs(args.tgt_amr)
+  sentences = index_sentences(src_index, singleview=True)
+  chosen = choose_sentences([sent_id for (sent_id, entries) in sentences], args)
+  src_amrs = amr_metadata.read_amrs(args.src_amr, consts_to_vars=True,
+    cache=args.cache, entries=chosen, index=src_index)
+  tgt_amrs = amr_metadata.read_amrs(args.tgt_amr, consts_to_vars=True,
+    cache=args.cache, entries=chosen, index=tgt_index)
+  next_sent = 0
+  for (n, src_amr, tgt_amr) in itertools.izip(chosen, src_amrs, tgt_amrs):
+    for skipped in range(next_sent, n):
+      aligner.skip_amrs()
+    if gold_aligned_fh:
+      skip_gold_alignments(gold_aligned_fh, n - next_sent)
+    next_sent = n + 1
+    src_amr.metadata.setdefault('id', sentences[n][0])
+    yield (src_amr, tgt_amr)
+
+
+def sentence_tasks(sentences, args, gold_aligned_fh=None):
+  """ Alignment tasks of the sentences for align_sentence, reading the
+  --align_in alignments of each in order. Returns generator of (sentence id,
+  gold AMR, test AMRs, gold alignments or None); no test AMRs means a single
+  AMR view of the gold AMR. """
+  for (cur_id, amrs_same_sent) in sentences:
+    gold_amr = amrs_same_sent[0]
+    test_amrs = amrs_same_sent[1:]
+    gold_alignments = None
+    if gold_aligned_fh:
+      # a single AMR view ignores the alignment written for it
+      gold_alignments = [get_next_gold_alignments(gold_aligned_fh)
+                         for a in test_amrs or [gold_amr]]
+    yield (cur_id, gold_amr, test_amrs, gold_alignments)
 
-      if (args.verbose):
-        print("ID: %s\n Sentence: %s\n gold anno: %s" % (cur_id, sent, gold_anno))
-
-      for (ind, a) in enumerate(test_amrs):
-        (g, score) = amr_graphs[ind]
-        test_anno = a.metadata['annotator']
-        if json_fh:
-          json_fh.write(json_graph.dumps(g) + '\n')
-        if align_fh:
-          sg = smatchgraphs[ind][0]
-          align_fh.write("""# ::id %s\n# ::tok %s\n# ::gold_anno %s\n# ::test_anno %s\n""" % \
-            (cur_id, sent, gold_anno, test_anno))
-          align_fh.write('\n'.join(sg.get_text_alignments()) + '\n\n')
-        if (args.verbose):
-          print("  annotator %s score: %d" % (test_anno, score))
-
-        ag = nx.drawing.nx_agraph.to_agraph(g)
-        ag.graph_attr['label'] = sent
-        ag.layout(prog=args.layout)
-        ag.draw('%s/%s_annotated_%s_%s.png' % (args.outdir, cur_id, gold_anno, test_anno))
 
-      amrs_same_sent = []
-      if cur_amr is not None:
-        cur_id = cur_amr.metadata['id']
-      else:
-        break
+def get_align_opts(args, write_json, write_alignments, unmatch_dead_nodes):
+  """ Options of align_sentence from the command line flags """
+  return {'num_restarts': args.num_restarts,
+          'search_opts': get_search_opts(args), 'write_json': write_json,
+          'write_alignments': write_alignments,
+          'unmatch_dead_nodes': unmatch_dead_nodes,
+          'all_pairs': args.agreement_out is not None}
 
-    amrs_same_sent.append(cur_amr)
 
-  infile.close()
+def init_align_worker(opts):
+  global align_opts
+  align_opts = opts
+
+
+def align_sentence(task):
+  """
+  Align the test AMRs of a sentence to its gold AMR, with the options given
+  to init_align_worker.
+  Input:
+    task: as from sentence_tasks
+  Returns (results, pair scores): for each test AMR (graph JSON or None,
+  graph DOT text, text alignments or None, smatch score, restarts used), and
+  the score_pairs counts of all its annotations if the options ask for them,
+  or None.
+  """
+  (cur_id, gold_amr, test_amrs, gold_alignments) = task
+  search_stats = []
+  if len(test_amrs) == 0:
+    smatchgraphs = [single_view(gold_amr)]
+    search_stats.append({'iterations': 0})
+  else:
+    smatchgraphs = hilight_disagreement(test_amrs, gold_amr,
+      align_opts['num_restarts'], gold_alignments=gold_alignments,
+      search_stats=search_stats, **align_opts['search_opts'])
+  amr_graphs = get_disagreement_graphs(smatchgraphs,
+    unmatch_dead_nodes=align_opts['unmatch_dead_nodes'])
+  sent = gold_amr.metadata['tok']
+
+  results = []
+  for (ind, (g, score)) in enumerate(amr_graphs):
+    (graph_json, alignments) = (None, None)
+    if align_opts['write_json']:
+      graph_json = json_graph.dumps(g)
+    if align_opts['write_alignments']:
+      alignments = '\n'.join(smatchgraphs[ind][0].get_text_alignments())
+    results.append((graph_json, graph_render.graph2dot(g, sent), alignments,
+                    score, search_stats[ind]['iterations']))
+  pair_scores = None
+  if align_opts['all_pairs'] and len(test_amrs):
+    # reuse the gold-test alignments, so that the scores match the graphs
+    if gold_alignments is not None:
+      gold_scores = [alignment_score(a, gold_amr, gold_alignments[ind])
+                     for (ind, a) in enumerate(test_amrs)]
+    else:
+      gold_scores = [score for (g, score) in smatchgraphs]
+    pair_scores = score_pairs([gold_amr] + test_amrs, gold_scores,
+      align_opts['num_restarts'], **align_opts['search_opts'])
+  return (results, pair_scores)
+
+
+def pipeline_map(fn, items, pool=None, window=1):
+  """ Apply fn to items in a multiprocessing pool, with at most window items
+  in flight, or in this process if pool is None. Returns generator of
+  (item, fn(item)) in the order of items. """
+  if pool is None:
+    for item in items:
+      yield (item, fn(item))
+    return
+  pending = deque()
+  for item in items:
+    pending.append((item, pool.apply_async(fn, (item,))))
+    if len(pending) >= window:
+      (item, result) = pending.popleft()
+      yield (item, result.get())
+  while pending:
+    (item, result) = pending.popleft()
+    yield (item, result.get())
+
+
+def monolingual_main(args):
+  """ Disagreement graphs for different annotations of a single sentence. """
+  renderer = get_renderer(args)
+  gold_aligned_fh = None
+  if args.align_in:
+    gold_aligned_fh = codecs.open(args.align_in, encoding='utf8')
+  (json_fh, align_fh) = open_output_files(args)
+  agreement_fh = None
+  if args.agreement_out:
+    agreement_fh = codecs.open(args.agreement_out, 'w', encoding='utf8')
+  corpus_labels = []
+  corpus_counts = {}
+  consts_to_vars = (gold_aligned_fh != None or align_fh != None)
+  if args.ids or args.range:
+    sentences = select_sentences(args, consts_to_vars, gold_aligned_fh)
+  else:
+    sentences = group_sentences(amr_metadata.read_amrs(args.infile,
+      consts_to_vars=consts_to_vars, cache=args.cache), args.singleview)
+
+  pool = None
+  align_opts = get_align_opts(args, json_fh != None, align_fh != None,
+                              gold_aligned_fh == None)
+  if args.jobs > 1:
+    import multiprocessing
+    # the workers align whole sentences; reading, writing the outputs in
+    # order and queueing the renderings stay in this process
+    pool = multiprocessing.Pool(args.jobs, init_align_worker, (align_opts,))
+  else:
+    init_align_worker(align_opts)
+  tasks = sentence_tasks(sentences, args, gold_aligned_fh)
+  for (task, (results, pair_scores)) in pipeline_map(align_sentence, tasks,
+      pool, SENTENCES_PER_JOB * args.jobs):
+    (cur_id, gold_amr, test_amrs, gold_alignments) = task
+    gold_anno = gold_amr.metadata['annotator']
+    sent = gold_amr.metadata['tok']
+
+    if (args.verbose):
+      print("ID: %s\n Sentence: %s\n gold anno: %s" % (cur_id, sent, gold_anno))
+
+    if pair_scores is not None:
+      labels = annotator_labels([gold_amr] + test_amrs)
+      counts = {}
+      add_pair_counts(counts, labels, pair_scores)
+      write_agreement(agreement_fh, '::id %s' % cur_id, labels, counts)
+      add_pair_counts(corpus_counts, labels, pair_scores)
+      corpus_labels.extend(l for l in labels if l not in corpus_labels)
+
+    for (a, (graph_json, dot, alignments, score, restarts)) in \
+        zip(test_amrs or [gold_amr], results):
+      test_anno = a.metadata['annotator']
+      if json_fh:
+        json_fh.write(graph_json + '\n')
+      if align_fh:
+        align_fh.write("""# ::id %s\n# ::tok %s\n# ::gold_anno %s\n# ::test_anno %s\n""" % \
+          (cur_id, sent, gold_anno, test_anno))
+        align_fh.write(alignments + '\n\n')
+      if (args.verbose):
+        print("  annotator %s score: %d restarts: %d" % (test_anno, score, restarts))
+
+      renderer.render(dot,
+        '%s/%s_annotated_%s_%s.%s' % (args.outdir, cur_id, gold_anno, test_anno,
+                                      renderer.extension))
+
+  if pool is not None:
+    pool.close()
+    pool.join()
+  if agreement_fh:
+    write_agreement(agreement_fh, 'corpus', corpus_labels, corpus_counts)
+    agreement_fh.close()
   gold_aligned_fh and gold_aligned_fh.close()
   close_output_files(json_fh, align_fh)
+  renderer.close()
+  smatch.close_restart_pool()
+  smatch.amr.reset_tables()
 
 
 def xlang_main(args):
   """ Disagreement graphs for aligned cross-language language. """
-  src_amr_fh = codecs.open(args.src_amr, encoding='utf8')
-  tgt_amr_fh = codecs.open(args.tgt_amr, encoding='utf8')
+  renderer = get_renderer(args)
   src2tgt_fh = codecs.open(args.align_src2tgt, encoding='utf8')
   tgt2src_fh = codecs.open(args.align_tgt2src, encoding='utf8')
   gold_aligned_fh = None
@@ -228,18 +565,22 @@ def xlang_main(args):
 
   amrs_same_sent = []
   aligner = Amr2AmrAligner(num_best=args.num_align_read, num_best_in_file=args.num_aligned_in_file, src2tgt_fh=src2tgt_fh, tgt2src_fh=tgt2src_fh)
-  while True:
-    (src_amr_line, src_comments) = amr_metadata.get_amr_line(src_amr_fh)
-    if src_amr_line == "":
-      break
-    (tgt_amr_line, tgt_comments) = amr_metadata.get_amr_line(tgt_amr_fh)
-    src_amr = amr_metadata.AmrMeta.from_parse(src_amr_line, src_comments, consts_to_vars=True)
-    tgt_amr = amr_metadata.AmrMeta.from_parse(tgt_amr_line, tgt_comments, consts_to_vars=True)
+  if args.ids or args.range:
+    pairs = select_pairs(args, aligner, gold_aligned_fh)
+  else:
+    pairs = itertools.izip(
+      amr_metadata.read_amrs(args.src_amr, consts_to_vars=True, cache=args.cache),
+      amr_metadata.read_amrs(args.tgt_amr, consts_to_vars=True, cache=args.cache))
+  for (src_amr, tgt_amr) in pairs:
     (cur_id, src_sent) = get_sent_info(src_amr.metadata)
     (tgt_id, tgt_sent) = get_sent_info(tgt_amr.metadata, dflt_id=cur_id)
     assert cur_id == tgt_id
 
-    smatchgraphs = hilight_disagreement([tgt_amr], src_amr, args.num_restarts, aligner=aligner, gold_aligned_fh=gold_aligned_fh)
+    search_stats = []
+    gold_alignments = None
+    if gold_aligned_fh:
+      gold_alignments = [get_next_gold_alignments(gold_aligned_fh)]
+    smatchgraphs = hilight_disagreement([tgt_amr], src_amr, args.num_restarts, aligner=aligner, gold_alignments=gold_alignments, search_stats=search_stats, **get_search_opts(args))
     amr_graphs = get_disagreement_graphs(smatchgraphs, aligner=aligner,
       unmatch_dead_nodes=(gold_aligned_fh == None))
 
@@ -249,19 +590,19 @@ def xlang_main(args):
       align_fh.write("""# ::id %s\n# ::src_snt %s\n# ::tgt_snt %s\n""" % (cur_id, src_sent, tgt_sent))
       align_fh.write('\n'.join(smatchgraphs[0].get_text_alignments()) + '\n\n')
     if (args.verbose):
-      print("ID: %s\n Sentence: %s\n Sentence: %s\n Score: %f" % (cur_id, src_sent, tgt_sent, amr_graphs[0][1]))
+      print("ID: %s\n Sentence: %s\n Sentence: %s\n Score: %f\n Restarts: %d" % (cur_id, src_sent, tgt_sent, amr_graphs[0][1], search_stats[0]['iterations']))
 
-    ag = nx.drawing.nx_agraph.to_agraph(amr_graphs[0][0])
-    ag.graph_attr['label'] = "%s\n%s" % (src_sent, tgt_sent)
-    ag.layout(prog=args.layout)
-    ag.draw('%s/%s.png' % (args.outdir, cur_id))
+    renderer.render(graph_render.graph2dot(amr_graphs[0][0],
+      "%s\n%s" % (src_sent, tgt_sent)),
+      '%s/%s.%s' % (args.outdir, cur_id, renderer.extension))
 
-  src_amr_fh.close()
-  tgt_amr_fh.close()
   src2tgt_fh.close()
   tgt2src_fh.close()
   gold_aligned_fh and gold_aligned_fh.close()
   close_output_files(json_fh, align_fh)
+  renderer.close()
+  smatch.close_restart_pool()
+  smatch.amr.reset_tables()
 
 
 if __name__ == '__main__':
@@ -289,15 +630,49 @@ if __name__ == '__main__':
     help='File to dump json graphs to.')
   parser.add_argument('--num_restarts', type=int, default=5,
     help='Number of random restarts to execute during hill-climbing algorithm.')
+  parser.add_argument('--jobs', type=int, default=1,
+    help='Number of processes aligning sentences in parallel (monolingual only)')
+  parser.add_argument('--restart_jobs', type=int, default=1,
+    help='Number of processes running the random restarts of each AMR pair in parallel.')
+  parser.add_argument('--patience', type=int, default=0,
+    help='Stop restarting after this many restarts in a row without improvement, 0 to run all --num_restarts.')
+  parser.add_argument('--min_restarts', type=int, default=0,
+    help='Number of restarts run before --patience or --restart_time may stop, after the first climb.')
+  parser.add_argument('--restart_time', type=float,
+    help='Seconds after which no new restart is started for an AMR pair.')
+  parser.add_argument('--time_budget', type=float,
+    help='Seconds the alignment of an AMR pair may take; the best alignment found by then is used.')
+  parser.add_argument('--search', choices=sorted(smatch.SEARCH_ENGINES), default='hill',
+    help='Smatch search method: hill-climbing (hill, or incremental), simulated annealing (anneal) or tabu search (tabu).')
+  parser.add_argument('--max_evals', type=int,
+    help='Steps sampled per restart by the anneal and tabu searches.')
+  parser.add_argument('--init', choices=['greedy', 'hungarian'], default='greedy',
+    help='Start of the first hill-climb: greedy by node labels, or the best assignment of estimated weights.')
+  parser.add_argument('--exact_limit', type=int, default=smatch.EXACT_LIMIT,
+    help='Node budget of the exact alignment search tried before restarting, 0 to disable.')
   parser.add_argument('--align_out',
     help="Human-readable alignments output file - WARNING, will force conversion of const nodes to var nodes for alignment")
   parser.add_argument('--align_in',
     help="Alignments from human-editable text file, as from align_out")
   parser.add_argument('--layout', default='dot',
     help='Graphviz output layout')
+  parser.add_argument('--render_jobs', type=int, default=1,
+    help='Number of processes laying out and drawing the graphs, 0 for one per core')
+  parser.add_argument('--render_cache',
+    help='Directory of previously rendered images, to reuse for unchanged graphs')
+  parser.add_argument('--no-render', action='store_true',
+    help='Write the graphs as DOT files, without layout, instead of drawing images')
   parser.add_argument('--singleview', action='store_true', 
                       help='If set, display each AMR in the file individually without alignments')
-  # TODO make interactive option and option to process a specific range
+  parser.add_argument('--cache', action='store_true',
+    help='Read the parsed AMRs from a binary cache next to each AMR file, building it when it is missing or stale')
+  parser.add_argument('--ids', nargs='+',
+    help='Only process the sentences with these ::id values')
+  parser.add_argument('--range', type=parse_range,
+    help='Only process the sentences in START:END, counted from 0 in file order (either end optional)')
+  parser.add_argument('--agreement_out',
+    help='In monolingual mode, file to write the Smatch score matrix of every pair of annotators to, per sentence and for the corpus.')
+  # TODO make interactive option
 
   args_conf = parser.parse_args()
   if args_conf.conf_file:
@@ -308,6 +683,10 @@ if __name__ == '__main__':
     args.verbose = False
   if not args.num_align_read:
     args.num_align_read = args.num_aligned_in_file
+  if args.jobs > 1 and args.restart_jobs > 1:
+    parser.error("--jobs and --restart_jobs cannot both be above 1.")
+  if args.agreement_out and (args.bitext or args.singleview):
+    parser.error("--agreement_out compares the annotations of each sentence, so it needs monolingual mode without --singleview.")
 
   if not os.path.exists(args.outdir):
     os.makedirs(args.outdir)
@@ -316,5 +695,5 @@ if __name__ == '__main__':
     xlang_main(args)
   else:
     if args.infile == None or args.outdir == None:
-      raise parser.error("Both --infile and --outdir are required flags.")
+      parser.error("Both --infile and --outdir are required flags.")
     monolingual_main(args)
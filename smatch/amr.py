@@ -9,11 +9,202 @@ http://amr.isi.edu/download/smatch-v1.0.tar.gz
 http://amr.isi.edu/smatch-13.pdf
 """
 
+import re
 import sys
+from array import array
+from bisect import bisect_left
 from collections import defaultdict
 
 
+class LabelTable(object):
+  """
+  Label interning table shared by a whole corpus run. Maps each label
+  (concept, relation name or constant) to the integer id of its lowercased
+  form, so two labels equal up to case get the same id, and keeps one shared
+  copy of each label string for the AMRs that use it.
+  """
+
+  def __init__(self):
+    self.ids = {}  # label -> id of its lowercased form
+    self.folded = {}  # lowercased label -> id
+    self.strings = {}  # label -> its shared copy
+
+  def label_id(self, label):
+    """Return the id of label, giving it one if it is new"""
+    label_id = self.ids.get(label)
+    if label_id is None:
+      label_id = self.folded.setdefault(label.lower(), len(self.folded))
+      self.ids[label] = label_id
+    return label_id
+
+  def intern(self, label):
+    """Return the shared copy of label, giving it an id if it is new"""
+    shared = self.strings.get(label)
+    if shared is None:
+      shared = self.strings[label] = label
+      self.label_id(label)
+    return shared
+
+  def clear(self):
+    """Forget every label. The dicts stay the same objects, so aliases of
+    them (e.g. smatch.label_ids) stay valid."""
+    self.ids.clear()
+    self.folded.clear()
+    self.strings.clear()
+
+# table of every AMR parsed by parse_AMR_line, and of every label compared
+# since, until reset_tables
+LABELS = LabelTable()
+
+# splits an AMR line at each bracket, colon or slash and each quoted string
+# (to its closing quote, if any); the spaces around them stay in the text,
+# since a relation keeps them (": b" is not ":b")
+AMR_SPLIT_RE = re.compile(r'([():/])|("[^"]*"?)')
+QUOTED_DROP_RE = re.compile(r'[():/]')  # characters dropped in quotes
+
+# version of parse_AMR_line and the AMR fields it fills; bump it when either
+# changes, so that stale amr_cache files are rebuilt
+PARSER_VERSION = 2
+
+
+# shared copy of each path2label path, until reset_tables
+PATH_TUPLES = {}
+
+
+def reset_tables():
+  """
+  Empty LABELS and PATH_TUPLES. Both are kept for the whole process and only
+  grow, so a corpus run empties them once it is done (see smatch.main); do
+  not call this in the middle of a comparison. AMRs parsed before stay valid:
+  their labels get new ids when they are next looked up, they just no longer
+  share strings and paths with the AMRs parsed after.
+  """
+  LABELS.clear()
+  PATH_TUPLES.clear()
+
+
+def path_tuple(path):
+  """Path as a tuple of child indices: 0.1.0 -> (0, 1, 0)"""
+  if isinstance(path, tuple):
+    return path
+  return tuple([int(p) for p in path.split('.')])
+
+
+def remove_paths(path2label, removed_paths):
+  """
+  Remove from path2label (with path tuples) the node at each of
+  removed_paths, and its descendants, in turn. The later siblings of a
+  removed node move down by one; the later removed_paths are not adjusted.
+  Returns the new path2label.
+  """
+  if not removed_paths:
+    return path2label
+  # tree of the paths: [label or None, {child index: subtree}]
+  root = [None, {}]
+  for (path, label) in path2label.items():
+    node = root
+    for p in path:
+      node = node[1].setdefault(p, [None, {}])
+    node[0] = label
+  for path in removed_paths:
+    if len(path) < 2:
+      continue  # nothing is at the root level but the head
+    parent = root
+    for p in path[:-1]:
+      parent = parent[1].get(p)
+      if parent is None:
+        break
+    if parent is None:
+      continue
+    n = path[-1]
+    parent[1] = dict((k - 1 if k > n else k, child)
+                     for (k, child) in parent[1].items() if k != n)
+  result = {}
+  todo = [((), root)]
+  while todo:
+    (path, node) = todo.pop()
+    if node[0] is not None:
+      result[path] = node[0]
+    for (k, child) in node[1].items():
+      todo.append((path + (k,), child))
+  return result
+
+
+class PathLabels(object):
+  """
+  Read-only view of the path2label mapping of an AMR. Looks paths up by
+  their dotted form (0.1.0) or as integer tuples in the AMR's sorted path
+  list, so no per-AMR dict is kept.
+  """
+  __slots__ = ('paths', 'labels')
+
+  def __init__(self, paths, labels):
+    self.paths = paths
+    self.labels = labels
+
+  def index(self, path):
+    key = path_tuple(path)
+    i = bisect_left(self.paths, key)
+    if i < len(self.paths) and self.paths[i] == key:
+      return i
+    return -1
+
+  def __getitem__(self, path):
+    i = self.index(path)
+    if i < 0:
+      raise KeyError(path)
+    return self.labels[i]
+
+  def get(self, path, default=None):
+    i = self.index(path)
+    if i < 0:
+      return default
+    return self.labels[i]
+
+  def __contains__(self, path):
+    return self.index(path) >= 0
+
+  def __len__(self):
+    return len(self.paths)
+
+  def keys(self):
+    return ['.'.join([str(p) for p in path]) for path in self.paths]
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def items(self):
+    return zip(self.keys(), self.labels)
+
+
+class ReadOnlyDict(dict):
+  """
+  dict that refuses changes, for the mappings an AMR builds from its lists
+  on request: changing them would not change the AMR, so it fails loudly.
+  """
+  __slots__ = ()
+
+  def read_only(self, *args, **kwargs):
+    raise TypeError("AMR link dicts are read-only views of the AMR")
+
+  __setitem__ = __delitem__ = read_only
+  clear = pop = popitem = setdefault = update = read_only
+
+  def __reduce__(self):
+    return (ReadOnlyDict, (dict(self),))
+
+
 class AMR(object):
+  """
+  An AMR kept in parallel lists: nodes (variable names) and var_values
+  (their concepts); link_src, link_tgt, link_label for the relations
+  between variables (as node indices); const_src, const_label, const_value
+  for the relations to constants; and paths, path_labels for path2label,
+  with the paths as sorted integer tuples.
+  """
+  __slots__ = ('nodes', 'var_values', 'link_src', 'link_tgt', 'link_label',
+               'const_src', 'const_label', 'const_value', 'paths',
+               'path_labels')
 
   def __init__(
           self,
@@ -21,86 +212,118 @@ class AMR(object):
           var_value_list=None,
           link_list=None,
           const_link_list=None,
-          path2label=None):
+          path2label=None,
+          labels=None):
     """
+    link_list: per variable, a dict of child variable -> relation
+    const_link_list: per variable, a dict of relation -> constant
     path2label: maps 0.1.0 to the label (inst or const) of the 0-indexed child
       of the 1-indexed child of the 0th node (head)
+    labels: LabelTable to intern the labels with, if any
     """
-    if var_list is None:
-      self.nodes = []  # AMR variables
-      self.root = None
-    else:
-      self.nodes = var_list[:]
-      if len(var_list) != 0:
-        self.root = var_list[0]
-      else:
-        self.root = None
-    if var_value_list is None:
-      self.var_values = []
-    else:
-      self.var_values = var_value_list[:]
-    if link_list is None:
-      # connections between instances  #adjacent list representation
-      self.links = []
-    else:
-      self.links = link_list[:]
-    if const_link_list is None:
-      self.const_links = []
-    else:
-      self.const_links = const_link_list[:]
-    if path2label is None:
-      self.path2label = {}
-    else:
-      self.path2label = path2label
-
-  def add_node(node_value):
-    self.nodes.append(node_value)
+    intern = labels.intern if labels is not None else lambda label: label
+    self.nodes = list(var_list or ())  # AMR variables
+    self.var_values = [intern(v) for v in var_value_list or ()]
+    node_index = {}
+    for (i, v) in enumerate(self.nodes):
+      node_index[v] = i
+    # connections between instances, in the order of the link dicts
+    (self.link_src, self.link_tgt) = (array('i'), array('i'))
+    self.link_label = []
+    for (i, d) in enumerate(link_list or ()):
+      for (k, v) in d.items():
+        self.link_src.append(i)
+        self.link_tgt.append(node_index[k])
+        self.link_label.append(intern(v))
+    self.const_src = array('i')
+    (self.const_label, self.const_value) = ([], [])
+    for (i, d) in enumerate(const_link_list or ()):
+      for (k, v) in d.items():
+        self.const_src.append(i)
+        self.const_label.append(intern(k))
+        self.const_value.append(intern(v))
+    path_items = sorted((path_tuple(k), v) for (k, v) in (path2label or {}).items())
+    self.paths = [PATH_TUPLES.setdefault(k, k) for (k, v) in path_items]
+    self.path_labels = [intern(v) for (k, v) in path_items]
+
+  @property
+  def root(self):
+    if len(self.nodes) != 0:
+      return self.nodes[0]
+    return None
+
+  @property
+  def links(self):
+    """Per variable, a read-only dict of child variable -> relation, built
+    from link_src, link_tgt and link_label on each access"""
+    links = [{} for v in self.nodes]
+    for (i, j, reln) in zip(self.link_src, self.link_tgt, self.link_label):
+      links[i][self.nodes[j]] = reln
+    return tuple(ReadOnlyDict(d) for d in links)
+
+  @property
+  def const_links(self):
+    """Per variable, a read-only dict of relation -> constant, built from
+    const_src, const_label and const_value on each access"""
+    const_links = [{} for v in self.nodes]
+    for (i, reln, const) in zip(self.const_src, self.const_label, self.const_value):
+      const_links[i][reln] = const
+    return tuple(ReadOnlyDict(d) for d in const_links)
+
+  @property
+  def path2label(self):
+    return PathLabels(self.paths, self.path_labels)
 
   def rename_node(self, prefix):
-    var_map_dict = {}
     for i in range(0, len(self.nodes)):
-      var_map_dict[self.nodes[i]] = prefix + str(i)
-    for i, v in enumerate(self.nodes):
-      self.nodes[i] = var_map_dict[v]
-    for i, d in enumerate(self.links):
-      new_dict = {}
-      for k, v in d.items():
-        new_dict[var_map_dict[k]] = v
-      self.links[i] = new_dict
+      self.nodes[i] = prefix + str(i)
 
   def get_triples(self):
     """Get the triples in two list: instance_triple, relation_triple"""
     instance_triple = []
     relation_triple = []
+    (l, c) = (0, 0)  # edges are in the order of their source variable
     for i in range(len(self.nodes)):
       instance_triple.append(("instance", self.nodes[i], self.var_values[i]))
-      for k, v in self.links[i].items():
-        relation_triple.append((v, self.nodes[i], k))
-      for k2, v2 in self.const_links[i].items():
-        relation_triple.append((k2, self.nodes[i], v2))
+      while l < len(self.link_src) and self.link_src[l] == i:
+        relation_triple.append((self.link_label[l], self.nodes[i],
+                                self.nodes[self.link_tgt[l]]))
+        l += 1
+      while c < len(self.const_src) and self.const_src[c] == i:
+        relation_triple.append((self.const_label[c], self.nodes[i],
+                                self.const_value[c]))
+        c += 1
     return (instance_triple, relation_triple)
 
   def get_triples2(self):
     """Get the triples in three lists: instance_triple, relation (two variables) triple, and relation (one variable) triple"""
-    instance_triple = []
-    relation_triple1 = []
-    relation_triple2 = []
-    for i in range(len(self.nodes)):
-      instance_triple.append(("instance", self.nodes[i], self.var_values[i]))
-      for k, v in self.links[i].items():
-        relation_triple2.append((v, self.nodes[i], k))
-      for k2, v2 in self.const_links[i].items():
-        relation_triple1.append((k2, self.nodes[i], v2))
+    nodes = self.nodes
+    instance_triple = [("instance", v, c) for (v, c) in zip(nodes, self.var_values)]
+    relation_triple1 = [(reln, nodes[i], const) for (i, reln, const)
+                        in zip(self.const_src, self.const_label, self.const_value)]
+    relation_triple2 = [(reln, nodes[i], nodes[j]) for (i, j, reln)
+                        in zip(self.link_src, self.link_tgt, self.link_label)]
+    return (instance_triple, relation_triple1, relation_triple2)
+
+  def get_indexed_triples(self):
+    """Get the triples in the three lists of get_triples2, but with every
+       variable given as its index in the node list (0, 1, 2...) instead of
+       its name, so no rename_node is needed before matching"""
+    instance_triple = [("instance", i, c) for (i, c) in enumerate(self.var_values)]
+    relation_triple1 = zip(self.const_label, self.const_src, self.const_value)
+    relation_triple2 = zip(self.link_label, self.link_src, self.link_tgt)
     return (instance_triple, relation_triple1, relation_triple2)
 
   def __str__(self):
     """Output AMR string"""
+    links = self.links
+    const_links = self.const_links
     for i in range(len(self.nodes)):
       print "Variable", i, self.nodes[i]
       print "Dependencies:"
-      for k, v in self.links[i].items():
+      for k, v in links[i].items():
         print "Variable", k, " via ", v
-      for k2, v2 in self.const_links[i].items():
+      for k2, v2 in const_links[i].items():
         print "Attribute:", k2, "value", v2
 
   def __repr__(self):
@@ -110,13 +333,18 @@ class AMR(object):
     self.__str__()
 
   @staticmethod
-  def parse_AMR_line(line, consts_to_vars=False):
+  def parse_AMR_line(line, consts_to_vars=False, labels=LABELS):
     # set consts_to_vars True if you want consts represented as variable nodes with
     # instance labels
+    # labels: LabelTable that interns the concepts, relation names and consts
+    # Gives the same AMR as the character-by-character parser it replaced
+    # (see tests/test_amr_parser.py), malformed lines included: None after an
+    # error message for the errors it detects, a partial AMR for unclosed
+    # brackets or quotes, and IndexError for a relation outside any bracket.
     # significant symbol just encountered: 1 for (, 2 for :, 3 for /
     state = -1
     stack = []  # variable stack
-    cur_charseq = []  # current processing char sequence
+    cur_charseq = []  # current processing text (tokens)
     var_dict = {}  # key: var name value: var value
     var_list = []  # variable name list (order: occurence of the variable
     # key: var name:  value: list of (attribute name, other variable)
@@ -124,104 +352,75 @@ class AMR(object):
     # key:var name, value: list of (attribute name, const value)
     var_attr_dict2 = defaultdict(list)
     cur_attr_name = ""  # current attribute name
-    attr_list = []  # each entry is an attr dict
-    in_quote = False
-    curr_path = ['0']
-    path2label = {}
-    path_lookup = {}  # (var, reln, const) to path key
-
-    def remove_from_paths(path):
-      """ Adjust all paths in path2label by removing the node at path
-          (and any descdendants) """
-      node_ind = int(path[-1])
-      depth = len(path) - 1
-      prefix = '.'.join(path[:-1]) + '.'
-      # remove node from path2label keys
-      new_path2label = {}
-      for (k, v) in path2label.items():
-        if k.startswith(prefix):
-          k_arr = k.split('.')
-          curr_ind = int(k_arr[depth])
-          if curr_ind == node_ind:
-            continue  # deleting node
-          elif curr_ind > node_ind:
-            # node index moves down by 1 since middle node removed
-            k_arr[depth] = str(curr_ind - 1)
-            new_path2label['.'.join(k_arr)] = v
-            continue
-        new_path2label[k] = v
-      return new_path2label
-
-      # remove node from path_lookup vals
-      for (k, v) in path_lookup.items():
-        if v[:depth] == path[:depth]:
-          curr_ind = int(v[depth])
-          if curr_ind == node_ind:
-            del path_lookup[k]
-          if curr_ind > node_ind:
-            v[depth] = str(curr_ind - 1)
-
-    for i, c in enumerate(line.strip()):
-      if c == " ":
-        if in_quote:
-          cur_charseq.append('_')
-          continue
-        if state == 2:
-          cur_charseq.append(c)
-        continue
-      elif c == "\"":
-        if in_quote:
-          in_quote = False
+    curr_path = [0]
+    path2label = {}  # path tuple to label
+    path_lookup = {}  # (var, reln, const) to path tuple
+    line = line.strip()
+
+    def position(k):
+      """Index in line of the bracket, colon or slash at pieces[k]"""
+      for (n, m) in enumerate(AMR_SPLIT_RE.finditer(line)):
+        if 3 * n + 1 == k:
+          return m.start(1)
+
+    # text, then (bracket/colon/slash or None, quoted string or None, text)
+    # for each split; spaces only separate the text of a relation (state 2)
+    pieces = AMR_SPLIT_RE.split(line)
+    if pieces[0].replace(" ", ""):
+      cur_charseq.append(pieces[0].replace(" ", ""))
+    for k in range(1, len(pieces), 3):
+      (c, quoted, text) = pieces[k:k + 3]
+      if quoted is not None:
+        # in quotes, spaces become _ and ( : / ) are dropped
+        if len(quoted) > 1 and quoted[-1] == "\"":
+          quoted = quoted[1:-1]
         else:
-          in_quote = True
+          quoted = quoted[1:]  # unclosed quote runs to the end
+        cur_charseq.append(QUOTED_DROP_RE.sub("", quoted).replace(" ", "_"))
       elif c == "(":
-        if in_quote:
-          continue
         if state == 2:
           if cur_attr_name != "":
+            i = position(k)
             print >> sys.stderr, "Format error when processing ", line[0:i + 1]
             return None
           cur_attr_name = "".join(cur_charseq).strip()
           cur_charseq[:] = []
         state = 1
       elif c == ":":
-        if in_quote:
-          continue
         if state == 3:  # (...:
           var_value = "".join(cur_charseq)
           cur_charseq[:] = []
           cur_var_name = stack[-1]
           var_dict[cur_var_name] = var_value
-          path2label['.'.join(curr_path)] = var_value
-          curr_path.append('0')
+          path2label[tuple(curr_path)] = var_value
+          curr_path.append(0)
         elif state == 2:  # : ...:
           temp_attr_value = "".join(cur_charseq)
           cur_charseq[:] = []
           parts = temp_attr_value.split()
           if len(parts) < 2:
+            i = position(k)
             print >> sys.stderr, "Error in processing", line[0:i + 1]
             return None
           attr_name = parts[0].strip()
           attr_value = parts[1].strip()
           if len(stack) == 0:
+            i = position(k)
             print >> sys.stderr, "Error in processing", line[
                 :i], attr_name, attr_value
             return None
           # TODO should all labels in quotes be consts?
           if attr_value not in var_dict:
             var_attr_dict2[stack[-1]].append((attr_name, attr_value))
-            path2label['.'.join(curr_path)] = attr_value
-            path_lookup[
-                (stack[-1], attr_name, attr_value)] = [i for i in curr_path]
-            curr_path[-1] = str(int(curr_path[-1]) + 1)
+            path2label[tuple(curr_path)] = attr_value
+            path_lookup[(stack[-1], attr_name, attr_value)] = tuple(curr_path)
+            curr_path[-1] += 1
           else:
             var_attr_dict1[stack[-1]].append((attr_name, attr_value))
         else:
-          curr_path[-1] = str(int(curr_path[-1]) + 1)
+          curr_path[-1] += 1
         state = 2
       elif c == "/":
-        if in_quote:
-          continue
         if state == 1:
           variable_name = "".join(cur_charseq)
           cur_charseq[:] = []
@@ -238,13 +437,13 @@ class AMR(object):
                   (cur_attr_name[:-3], stack[-2]))
             cur_attr_name = ""
         else:
+          i = position(k)
           print >> sys.stderr, "Error in parsing AMR", line[0:i + 1]
           return None
         state = 3
       elif c == ")":
-        if in_quote:
-          continue
         if len(stack) == 0:
+          i = position(k)
           print >> sys.stderr, "Unmatched parathesis at position", i, "in processing", line[
               0:i + 1]
           return None
@@ -253,6 +452,7 @@ class AMR(object):
           cur_charseq[:] = []
           parts = temp_attr_value.split()
           if len(parts) < 2:
+            i = position(k)
             print >> sys.stderr, "Error processing", line[
                 :i + 1], temp_attr_value
             return None
@@ -265,23 +465,24 @@ class AMR(object):
             var_attr_dict2[stack[-1]].append((attr_name, attr_value))
           else:
             var_attr_dict1[stack[-1]].append((attr_name, attr_value))
-          path2label['.'.join(curr_path)] = attr_value
-          path_lookup[
-              (stack[-1], attr_name, attr_value)] = [i for i in curr_path]
+          path2label[tuple(curr_path)] = attr_value
+          path_lookup[(stack[-1], attr_name, attr_value)] = tuple(curr_path)
           curr_path.pop()
         elif state == 3:
           var_value = "".join(cur_charseq)
           cur_charseq[:] = []
           cur_var_name = stack[-1]
           var_dict[cur_var_name] = var_value
-          path2label['.'.join(curr_path)] = var_value
+          path2label[tuple(curr_path)] = var_value
         else:
           curr_path.pop()
         stack.pop()
         cur_attr_name = ""
         state = 4
-      else:
-        cur_charseq.append(c)
+      if state != 2:
+        text = text.replace(" ", "")
+      if text:
+        cur_charseq.append(text)
     # create var_list, link_list, attribute
     # keep original variable name.
     var_value_list = []
@@ -293,6 +494,7 @@ class AMR(object):
     const_var_list = []
     const_var_value_list = []
     const_link_list = []
+    removed_paths = []  # paths of the consts that turned out to be variables
 
     for v in var_list:
       if v not in var_dict:
@@ -313,7 +515,7 @@ class AMR(object):
           elif v2[1] in var_dict:
             # not the first occurrence of this child var
             link_dict[v2[1]] = v2[0]
-            path2label = remove_from_paths(path_lookup[(v, v2[0], v2[1])])
+            removed_paths.append(path_lookup[(v, v2[0], v2[1])])
             continue
 
           if consts_to_vars:
@@ -331,6 +533,7 @@ class AMR(object):
       if not consts_to_vars:
         const_attr_list.append(const_dict)
       link_list[0][var_list[0]] = "TOP"
+    path2label = remove_paths(path2label, removed_paths)
     if consts_to_vars:
       var_list += const_var_list
       var_value_list += const_var_value_list
@@ -341,5 +544,6 @@ class AMR(object):
         var_value_list,
         link_list,
         const_attr_list,
-        path2label)
+        path2label,
+        labels)
     return result_amr
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""
+amr_cache.py
+
+Binary cache of a parsed AMR file, kept next to it as <file>.amrcache (or
+<file>.consts.amrcache when constants are parsed as variables), so that
+scoring many outputs against the same gold file parses the gold file once.
+
+Layout of a cache file:
+
+  MAGIC
+  key line: sha1 of the AMR file, PARSER_VERSION and the consts_to_vars flag
+  one pickled amr_record per AMR entry
+  pickled (offset of each record, label of each label id)
+  offset of that list, as a little-endian unsigned 64-bit int
+
+A cache whose key does not match its AMR file is rebuilt. Records are read
+by offset, one at a time, as the AMRs are asked for.
+"""
+
+import codecs
+from array import array
+import cPickle as pickle
+import hashlib
+import os
+import struct
+import sys
+
+from amr import AMR, LABELS, PARSER_VERSION, PATH_TUPLES
+
+MAGIC = "AMRCACHE\n"
+FOOTER = struct.Struct("<Q")
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def get_amr_entry(infile):
+  """Read an entry from the input file. AMRs are separated by blank lines.
+     Returns:
+         (AMR line, comment lines); the AMR line is "" at the end of the file"""
+  cur_comments = []
+  cur_amr = []
+  has_content = False
+  for line in infile:
+    if line[0] == "(" and len(cur_amr) != 0:
+      cur_amr = []
+    if line.strip() == "":
+      if not has_content:
+        continue
+      else:
+        break
+    elif line.strip().startswith("#"):
+      cur_comments.append(line.strip())
+    else:
+      has_content = True
+      cur_amr.append(line.strip())
+  return ("".join(cur_amr), cur_comments)
+
+
+def cache_path(path, consts_to_vars=False):
+  """Path of the cache file of the AMR file at path"""
+  if consts_to_vars:
+    return path + ".consts.amrcache"
+  return path + ".amrcache"
+
+
+def cache_key(path, consts_to_vars=False):
+  """Key line identifying the contents of the AMR file and the parser"""
+  digest = hashlib.sha1()
+  with open(path, "rb") as f:
+    block = f.read(HASH_BLOCK_SIZE)
+    while block:
+      digest.update(block)
+      block = f.read(HASH_BLOCK_SIZE)
+  return "%s %d %d\n" % (digest.hexdigest(), PARSER_VERSION, consts_to_vars)
+
+
+LABEL_FIELDS = ('var_values', 'link_label', 'const_label', 'const_value',
+                'path_labels')  # AMR fields stored as label table ids
+
+
+def amr_record(parsed, comments, table):
+  """Compact record of a parsed AMR, to pickle without its class. Labels are
+     stored as ids in table (label -> id, extended with new labels), index
+     lists as machine ints and paths flattened, with their lengths.
+     Returns:
+         (nodes, label ids, link_src, link_tgt, const_src, path lengths,
+          path indices, comment lines), or (None, comments) if parsed is None"""
+  if parsed is None:
+    return (None, comments)
+  label_ids = array('i')
+  for name in LABEL_FIELDS:
+    label_ids.extend(table.setdefault(v, len(table))
+                     for v in getattr(parsed, name))
+  path_lens = array('i', [len(k) for k in parsed.paths])
+  path_indices = array('i')
+  for k in parsed.paths:
+    path_indices.extend(k)
+  return (parsed.nodes, label_ids.tostring(), parsed.link_src.tostring(),
+          parsed.link_tgt.tostring(), parsed.const_src.tostring(),
+          path_lens.tostring(), path_indices.tostring(), comments)
+
+
+def record_amr(record, strings):
+  """Rebuild the AMR and comment lines of an amr_record.
+     Args:
+         record: amr_record tuple
+         strings: label of each table id
+     Returns:
+         (AMR, comment lines)"""
+  if record[0] is None:
+    return (None, record[1])
+  (nodes, label_ids, link_src, link_tgt, const_src, path_lens, path_indices,
+   comments) = record
+  parsed = AMR.__new__(AMR)
+  parsed.nodes = nodes
+  parsed.link_src = array('i', link_src)
+  parsed.link_tgt = array('i', link_tgt)
+  parsed.const_src = array('i', const_src)
+  path_lens = array('i', path_lens)
+  labels = [strings[i] for i in array('i', label_ids)]
+  start = 0
+  for (name, size) in zip(LABEL_FIELDS, (len(nodes), len(parsed.link_src),
+                                         len(parsed.const_src),
+                                         len(parsed.const_src),
+                                         len(path_lens))):
+    setattr(parsed, name, labels[start:start + size])
+    start += size
+  path_indices = array('i', path_indices)
+  parsed.paths = []
+  start = 0
+  for size in path_lens:
+    k = tuple(path_indices[start:start + size])
+    parsed.paths.append(PATH_TUPLES.setdefault(k, k))
+    start += size
+  return (parsed, comments)
+
+
+def parse_entries(path, consts_to_vars=False, labels=LABELS):
+  """Parse each entry of the AMR file at path.
+     Returns:
+         generator of (AMR, comment lines); the AMR is None if it did not parse"""
+  with codecs.open(path, encoding='utf8') as infile:
+    while True:
+      (amr_line, comments) = get_amr_entry(infile)
+      if amr_line == "":
+        break
+      parsed = AMR.parse_AMR_line(amr_line, consts_to_vars=consts_to_vars,
+                                  labels=labels)
+      yield (parsed, comments)
+
+
+def write_cache(path, key, consts_to_vars=False, labels=LABELS):
+  """Parse the AMR file at path and write its cache file under key.
+     Returns:
+         AmrList of (AMR, comment lines) of the file"""
+  entries = AmrList(parse_entries(path, consts_to_vars, labels))
+  out_path = cache_path(path, consts_to_vars)
+  tmp_path = "%s.%d.tmp" % (out_path, os.getpid())
+  try:
+    with open(tmp_path, "wb") as out:
+      out.write(MAGIC)
+      out.write(key)
+      offsets = array('l')
+      table = {}
+      for (parsed, comments) in entries:
+        offsets.append(out.tell())
+        pickle.dump(amr_record(parsed, comments, table), out, 2)
+      index_offset = out.tell()
+      strings = sorted(table, key=table.get)
+      pickle.dump((offsets.tostring(), strings), out, 2)
+      out.write(FOOTER.pack(index_offset))
+    # replace the old cache in one step, for concurrent readers
+    os.rename(tmp_path, out_path)
+  except (IOError, OSError) as e:
+    print >> sys.stderr, "Warning: cannot write AMR cache", out_path, "-", e
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+  return entries
+
+
+class AmrList(list):
+  """
+  List of the (AMR, comment lines) entries just parsed, with the close and
+  with-statement interface of AmrCache.
+  """
+
+  def close(self):
+    pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+class AmrCache(object):
+  """
+  Sequence of the (AMR, comment lines) records of a cache file. Only the
+  record offsets are read up front; each record is read when it is asked for,
+  so the cache file stays open until close() is called, or the with
+  statement that holds the AmrCache ends.
+  """
+
+  def __init__(self, cache_file, labels=LABELS):
+    self.cache_file = cache_file
+    self.infile = open(cache_file, "rb")
+    self.infile.seek(-FOOTER.size, os.SEEK_END)
+    (index_offset,) = FOOTER.unpack(self.infile.read(FOOTER.size))
+    self.infile.seek(index_offset)
+    (offsets, strings) = pickle.load(self.infile)
+    self.offsets = array('l', offsets)
+    self.strings = [labels.intern(v) for v in strings]
+
+  def __len__(self):
+    return len(self.offsets)
+
+  def __getitem__(self, i):
+    self.infile.seek(self.offsets[i])
+    return record_amr(pickle.load(self.infile), self.strings)
+
+  def __iter__(self):
+    for i in xrange(len(self.offsets)):
+      yield self[i]
+
+  def close(self):
+    self.infile.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+def read_key(cache_file):
+  """Key line of a cache file, or None if it is not a cache file"""
+  try:
+    with open(cache_file, "rb") as f:
+      if f.read(len(MAGIC)) != MAGIC:
+        return None
+      return f.readline()
+  except IOError:
+    return None
+
+
+def load_amrs(path, consts_to_vars=False, labels=LABELS):
+  """Parsed entries of the AMR file at path, from its cache file. The cache
+     is (re)built first if it is missing or does not match the file.
+     Args:
+         path: AMR file
+         consts_to_vars: parse constants as variables (see parse_AMR_line)
+         labels: LabelTable to intern the labels with
+     Returns:
+         sequence of (AMR, comment lines), with AMR None where it did not
+         parse: an AmrCache, or the AmrList just parsed if the cache was
+         rebuilt. Close it, or use it in a with statement, once its records
+         are read."""
+  cache_file = cache_path(path, consts_to_vars)
+  key = cache_key(path, consts_to_vars)
+  if read_key(cache_file) != key:
+    return write_cache(path, key, consts_to_vars, labels)
+  return AmrCache(cache_file, labels)
@@ -10,6 +10,7 @@ http://amr.isi.edu/smatch-13.pdf
 """
 
 import amr
+import amr_cache
 import sys
 import subprocess
 import smatch
@@ -73,12 +74,13 @@ Args:
    file_list: file list
    dir_pre: the file location prefix
    start_num: the number of restarts in smatch
+   cache: read the parsed AMRs from amr_cache files
 Returns:
    smatch f score.
 """
 
 
-def compute_files(user1, user2, file_list, dir_pre, start_num):
+def compute_files(user1, user2, file_list, dir_pre, start_num, cache=False):
    # print file_list
    # print user1, user2
   match_total = 0
@@ -94,21 +96,34 @@ def compute_files(user1, user2, file_list, dir_pre, start_num):
     if not os.path.exists(file2):
       print >> ERROR_LOG, "*********Error: ", file2, "does not exist*********"
       return -1.00
-    try:
-      file1_h = open(file1, "r")
-      file2_h = open(file2, "r")
-    except:
-      print >> ERROR_LOG, "Cannot open the files", file1, file2
-    cur_amr1 = smatch.get_amr_line(file1_h)
-    cur_amr2 = smatch.get_amr_line(file2_h)
-    if(cur_amr1 == ""):
-      print >> ERROR_LOG, "AMR 1 is empty"
-      continue
-    if(cur_amr2 == ""):
-      print >> ERROR_LOG, "AMR 2 is empty"
-      continue
-    amr1 = amr.AMR.parse_AMR_line(cur_amr1)
-    amr2 = amr.AMR.parse_AMR_line(cur_amr2)
+    if cache:
+      # first parsed AMR of each file, from its amr_cache file
+      with amr_cache.load_amrs(file1) as entries1, \
+          amr_cache.load_amrs(file2) as entries2:
+        if len(entries1) == 0:
+          print >> ERROR_LOG, "AMR 1 is empty"
+          continue
+        if len(entries2) == 0:
+          print >> ERROR_LOG, "AMR 2 is empty"
+          continue
+        amr1 = entries1[0][0]
+        amr2 = entries2[0][0]
+    else:
+      try:
+        file1_h = open(file1, "r")
+        file2_h = open(file2, "r")
+      except:
+        print >> ERROR_LOG, "Cannot open the files", file1, file2
+      cur_amr1 = smatch.get_amr_line(file1_h)
+      cur_amr2 = smatch.get_amr_line(file2_h)
+      if(cur_amr1 == ""):
+        print >> ERROR_LOG, "AMR 1 is empty"
+        continue
+      if(cur_amr2 == ""):
+        print >> ERROR_LOG, "AMR 2 is empty"
+        continue
+      amr1 = amr.AMR.parse_AMR_line(cur_amr1)
+      amr2 = amr.AMR.parse_AMR_line(cur_amr2)
     test_label = "a"
     gold_label = "b"
     amr1.rename_node(test_label)
@@ -164,7 +179,6 @@ def compute_files(user1, user2, file_list, dir_pre, start_num):
     match_total += best_match_num
     test_total += len(test_inst) + len(test_rel1) + len(test_rel2)
     gold_total += len(gold_inst) + len(gold_rel1) + len(gold_rel2)
-    smatch.match_num_dict.clear()
   (precision, recall, f_score) = smatch.compute_f(
       match_total, test_total, gold_total)
   return "%.2f" % f_score
@@ -205,6 +219,8 @@ def print_help():
   print "Example: smatch.py nw_wsj_0001_1 nw_wsj_0001_2 -p user1 user2"
   print "-r: (Optional) the number of random starts(higher number may results in higher accuracy and slower speed (default number of starts: 10)"
   print "Example: smatch.py -f file -p user1 user2 -r 20"
+  print "--cache: (Optional) read the parsed AMRs from a binary cache next to each AMR file, built on first use"
+  print "Example: smatch.py -f file -p user1 user2 --cache"
  # print "-d: detailed output, including alignment and triples of the two files"
  # print "Example (if you want to use all options): smatch.py file1 file2
  # -d -r 20"
@@ -235,6 +251,10 @@ def build_arg_parser():
       '-v',
       action='store_true',
       help='Verbose output (Default:False)')
+  parser.add_argument(
+      '--cache',
+      action='store_true',
+      help='Read the parsed AMRs from a binary cache next to each AMR file (Default:False)')
   return parser
 """
 Callback function to handle variable number of arguments in optparse
@@ -288,7 +308,12 @@ def build_arg_parser2():
       action='store_true',
       dest="v",
       help='Verbose output (Default:False)')
-  parser.set_defaults(r=4, v=False, ms=False, fd=isi_dir_pre)
+  parser.add_option(
+      "--cache",
+      action='store_true',
+      dest="cache",
+      help='Read the parsed AMRs from a binary cache next to each AMR file (Default:False)')
+  parser.set_defaults(r=4, v=False, ms=False, fd=isi_dir_pre, cache=False)
   return parser
 
 
@@ -381,7 +406,8 @@ def main(args):
                 names[j],
                 ids,
                 args.fd,
-                args.r))
+                args.r,
+                args.cache))
         end = time.clock()
         if table[i + 1][-1] != -1.0:
           acc_time += end - start
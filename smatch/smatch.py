@@ -12,11 +12,20 @@ http://amr.isi.edu/download/smatch-v1.0.tar.gz
 http://amr.isi.edu/smatch-13.pdf
 """
 import codecs
+from collections import deque
+import cPickle as pickle
 import sys
 import os
 import time
 import random
+import math
+from itertools import count, izip_longest
 import amr
+import amr_cache
+try:
+  import weight_array  # array-backed pool, needs numpy
+except ImportError:
+  weight_array = None
 #import optparse
 # import argparse #argparse only works for python 2.7. If you are using
 # older versin of Python, you can use optparse instead.
@@ -27,9 +36,69 @@ single_score = True  # global variable, single score output control
 
 pr_flag = False  # global variable, output precision and recall
 
+pair_options = {}  # global variable, get_fh keyword arguments for each AMR pair
+
+JOB_BATCH_SIZE = 8  # AMR pairs sent to a --jobs worker at a time
+
 ERROR_LOG = sys.stderr
 
-match_num_dict = {}  # key: match number tuples	value: the matching number
+label_ids = amr.LABELS.ids  # case-folded label ids, shared with the AMR parser
+
+MEMO_SIZE = 10000  # default bound on the match number memo of a get_fh call
+
+EXACT_LIMIT = 20000  # default node budget of the exact search in get_fh
+
+EXACT_MAX_VARS = 60  # the exact search is only tried on pairs with at most
+EXACT_MAX_SPACE = 25  # this many test variables and 10**this many matches
+
+EPSILON = 1e-9  # match number differences below this are float noise
+
+SAMPLE_EVALS = 2000  # default steps per test variable sampled by anneal/tabu
+
+ANNEAL_START_TEMP = 0.3  # annealing temperature, in matched triples
+ANNEAL_END_TEMP = 0.02
+
+TABU_SAMPLE = 100  # steps sampled per tabu search iteration
+TABU_TENURE = 10  # iterations before a variable may go back to where it was
+
+
+class MatchMemo(object):
+  """
+  Bounded memo of match numbers, keyed by match tuples. Entries live in two
+  generations: when the newer one fills up, the older one is dropped, so the
+  memo keeps at most 2 * max_size entries and favours recently used matches.
+  A max_size of 0 disables the memo.
+  """
+
+  def __init__(self, max_size=MEMO_SIZE):
+    self.max_size = max_size
+    self.recent = {}
+    self.older = {}
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, match):
+    """Return the remembered match number of match, or None"""
+    if not self.max_size:
+      return None
+    key = tuple(match)
+    if key in self.recent:
+      self.hits += 1
+      return self.recent[key]
+    if key in self.older:
+      self.hits += 1
+      self.put(match, self.older[key])
+      return self.older[key]
+    self.misses += 1
+    return None
+
+  def put(self, match, match_num):
+    if not self.max_size:
+      return
+    if len(self.recent) >= self.max_size:
+      self.older = self.recent
+      self.recent = {}
+    self.recent[tuple(match)] = match_num
 
 
 def get_amr_line(input_f):
@@ -82,6 +151,68 @@ def build_arg_parser():
       action='store_true',
       default=False,
       help="Output precision and recall as well as the f-score. Default: false")
+  parser.add_argument(
+      '--backend',
+      choices=["dict", "array"],
+      default="dict",
+      help="Candidate pool representation: dict, or array (requires numpy). Default: dict")
+  parser.add_argument(
+      '--search',
+      choices=sorted(SEARCH_ENGINES),
+      default="hill",
+      help="Search method: hill, incremental (hill-climbing with incremental gains), anneal (simulated annealing) or tabu (tabu search); all but hill need the dict backend. Default: hill")
+  parser.add_argument(
+      '--max_evals',
+      type=int,
+      help="Steps sampled per restart by the anneal and tabu searches (Default: %d per variable)" % SAMPLE_EVALS)
+  parser.add_argument(
+      '--memo_size',
+      type=int,
+      default=MEMO_SIZE,
+      help="Bound on the match number memo kept per AMR pair, 0 to disable (Default: %d)" % MEMO_SIZE)
+  parser.add_argument(
+      '--restart_jobs',
+      type=int,
+      default=1,
+      help="Number of processes running the restarts of each AMR pair in parallel (Default: 1)")
+  parser.add_argument(
+      '--jobs',
+      type=int,
+      default=1,
+      help="Number of processes scoring AMR pairs in parallel (Default: 1)")
+  parser.add_argument(
+      '--patience',
+      type=int,
+      default=0,
+      help="Stop restarting an AMR pair after this many restarts in a row without improvement, 0 to run all -r restarts (Default: 0)")
+  parser.add_argument(
+      '--min_restarts',
+      type=int,
+      default=0,
+      help="Number of restarts run before --patience or --restart_time may stop, after the first climb (Default: 0)")
+  parser.add_argument(
+      '--restart_time',
+      type=float,
+      help="Seconds after which no new restart is started for an AMR pair (Default: no limit)")
+  parser.add_argument(
+      '--time_budget',
+      type=float,
+      help="Seconds an AMR pair may take; the best alignment found by then is used (Default: no limit)")
+  parser.add_argument(
+      '--init',
+      choices=["greedy", "hungarian"],
+      default="greedy",
+      help="Start of the first climb: greedy (by node labels), or hungarian (best assignment of estimated weights). Default: greedy")
+  parser.add_argument(
+      '--exact_limit',
+      type=int,
+      default=EXACT_LIMIT,
+      help="Node budget of the exact search tried on small enough AMR pairs before restarting, 0 to disable (Default: %d)" % EXACT_LIMIT)
+  parser.add_argument(
+      '--cache',
+      action='store_true',
+      default=False,
+      help="Read the parsed AMRs from a binary cache next to each input file, building it when it is missing or stale (Default: False)")
   return parser
 
 
@@ -121,7 +252,78 @@ def build_arg_parser2():
       action='store_true',
       dest="pr",
       help="Output precision and recall as well as the f-score. Default: false")
-  parser.set_defaults(r=4, v=False, ms=False, pr=False)
+  parser.add_option(
+      "--backend",
+      dest="backend",
+      type="choice",
+      choices=["dict", "array"],
+      help="Candidate pool representation: dict, or array (requires numpy). Default: dict")
+  parser.add_option(
+      "--search",
+      dest="search",
+      type="choice",
+      choices=sorted(SEARCH_ENGINES),
+      help="Search method: hill, incremental (hill-climbing with incremental gains), anneal (simulated annealing) or tabu (tabu search); all but hill need the dict backend. Default: hill")
+  parser.add_option(
+      "--max_evals",
+      dest="max_evals",
+      type="int",
+      help="Steps sampled per restart by the anneal and tabu searches (Default: %d per variable)" % SAMPLE_EVALS)
+  parser.add_option(
+      "--memo_size",
+      dest="memo_size",
+      type="int",
+      help="Bound on the match number memo kept per AMR pair, 0 to disable (Default: %d)" % MEMO_SIZE)
+  parser.add_option(
+      "--restart_jobs",
+      dest="restart_jobs",
+      type="int",
+      help="Number of processes running the restarts of each AMR pair in parallel (Default: 1)")
+  parser.add_option(
+      "--jobs",
+      dest="jobs",
+      type="int",
+      help="Number of processes scoring AMR pairs in parallel (Default: 1)")
+  parser.add_option(
+      "--patience",
+      dest="patience",
+      type="int",
+      help="Stop restarting an AMR pair after this many restarts in a row without improvement, 0 to run all -r restarts (Default: 0)")
+  parser.add_option(
+      "--min_restarts",
+      dest="min_restarts",
+      type="int",
+      help="Number of restarts run before --patience or --restart_time may stop, after the first climb (Default: 0)")
+  parser.add_option(
+      "--restart_time",
+      dest="restart_time",
+      type="float",
+      help="Seconds after which no new restart is started for an AMR pair (Default: no limit)")
+  parser.add_option(
+      "--time_budget",
+      dest="time_budget",
+      type="float",
+      help="Seconds an AMR pair may take; the best alignment found by then is used (Default: no limit)")
+  parser.add_option(
+      "--init",
+      dest="init",
+      type="choice",
+      choices=["greedy", "hungarian"],
+      help="Start of the first climb: greedy (by node labels), or hungarian (best assignment of estimated weights). Default: greedy")
+  parser.add_option(
+      "--exact_limit",
+      dest="exact_limit",
+      type="int",
+      help="Node budget of the exact search tried on small enough AMR pairs before restarting, 0 to disable (Default: %d)" % EXACT_LIMIT)
+  parser.add_option(
+      "--cache",
+      action='store_true',
+      dest="cache",
+      help="Read the parsed AMRs from a binary cache next to each input file, building it when it is missing or stale (Default: False)")
+  parser.set_defaults(r=4, v=False, ms=False, pr=False, backend="dict", search="hill",
+                      memo_size=MEMO_SIZE, restart_jobs=1, jobs=1, exact_limit=EXACT_LIMIT,
+                      patience=0, min_restarts=0, restart_time=None, time_budget=None,
+                      init="greedy", max_evals=None, cache=False)
   return parser
 
 
@@ -130,10 +332,59 @@ def dflt_label_weighter(test_label, gold_label):
   Return score corresponding to the weight to add for matching
   test_label and gold_label in the default Smatch setting.
   """
-  if test_label.lower() == gold_label.lower():
+  try:
+    same = label_ids[test_label] == label_ids[gold_label]
+  except KeyError:  # not seen by the parser
+    same = label_id(test_label) == label_id(gold_label)
+  if same:
     return 1.0
   else:
     return 0.0
+# lets the array backend compare labels in bulk instead of calling the function
+dflt_label_weighter.case_insensitive = True
+
+
+def label_id(label):
+  """Label class of weight functions that only match labels equal up to case:
+     the id of the label in amr.LABELS"""
+  return amr.LABELS.label_id(label)
+
+
+def no_label_class(label):
+  """Label class of weight functions that may match any two labels"""
+  return None
+
+# A weight function may declare a label_class function: labels of different
+# classes always get weight 0, so compute_pool only compares labels within a
+# class.
+dflt_label_weighter.label_class = label_id
+
+
+def index_triples(triples, label_class):
+  """Map each label class to the indices of the triples whose relation name
+     is in it, in order"""
+  index = {}
+  for (i, triple) in enumerate(triples):
+    index.setdefault(label_class(triple[0]), []).append(i)
+  return index
+
+
+def index_vars(triples, label, num_vars=1):
+  """Triples with their variables as int indices, e.g. a3 -> 3 for label a
+     Args:
+         triples: triples with variables at positions 1 to num_vars
+         label: the prefix of the variables, or None if they already are
+             indices (as from AMR.get_indexed_triples)
+         num_vars: 1 for instance and one-variable relation triples, 2 for
+             two-variable relation triples
+     Returns:
+         the triples with int variables"""
+  if label is None:
+    return triples
+  n = len(label)
+  if num_vars == 1:
+    return [(t[0], int(t[1][n:]), t[2]) for t in triples]
+  return [(t[0], int(t[1][n:]), int(t[2][n:])) for t in triples]
 
 
 def compute_pool(test_instance, test_relation1, test_relation2,
@@ -149,11 +400,20 @@ def compute_pool(test_instance, test_relation1, test_relation2,
     gold_instance: instance triples in AMR 2
     gold_relation1: relation triples which contain only one variable in AMR 2
     gold_relations: relation triples which contain two variables in AMR 2
-    test_label: the prefix of the variable in AMR 1, e.g. a (variable a1, a2, a3...)
-    gold_label: the prefix of the variable in AMR 2, e.g. b (variable b1, b2, b3...)
+    test_label: the prefix of the variable in AMR 1, e.g. a (variable a1, a2, a3...),
+        or None if the variables are indices (AMR.get_indexed_triples)
+    gold_label: the prefix of the variable in AMR 2, e.g. b (variable b1, b2, b3...),
+        or None if the variables are indices
   Returns:
     candidate_match: a list of candidate mapping variables. Each entry contains a set of the variables the variable can map to.
     weight_dict: a dictionary which contains the matching triple number of every pair of variable mapping. """
+  # parse the variable numbers once, not in the loops below
+  (test_instance, test_relation1) = [index_vars(t, test_label)
+                                     for t in (test_instance, test_relation1)]
+  (gold_instance, gold_relation1) = [index_vars(t, gold_label)
+                                     for t in (gold_instance, gold_relation1)]
+  test_relation2 = index_vars(test_relation2, test_label, 2)
+  gold_relation2 = index_vars(gold_relation2, gold_label, 2)
   len_test_inst = len(test_instance)
   len_gold_inst = len(gold_instance)
   len_test_rel1 = len(test_relation1)
@@ -164,12 +424,14 @@ def compute_pool(test_instance, test_relation1, test_relation2,
   weight_dict = {}
   for i in range(0, len_test_inst):
     candidate_match.append(set())
+  test_inst_ids = [label_id(t[0]) for t in test_instance]
+  gold_inst_ids = [label_id(t[0]) for t in gold_instance]
   for i in range(0, len_test_inst):
     for j in range(0, len_gold_inst):
-      if test_instance[i][0].lower() == gold_instance[j][0].lower():
+      if test_inst_ids[i] == gold_inst_ids[j]:
         w = node_weight_fn(test_instance[i][2], gold_instance[j][2])
-        var1_num = int(test_instance[i][1][len(test_label):])
-        var2_num = int(gold_instance[j][1][len(gold_label):])
+        var1_num = test_instance[i][1]
+        var2_num = gold_instance[j][1]
         candidate_match[var1_num].add(var2_num)
         cur_k = (var1_num, var2_num)
         if cur_k in weight_dict:
@@ -177,28 +439,33 @@ def compute_pool(test_instance, test_relation1, test_relation2,
         else:
           weight_dict[cur_k] = {}
           weight_dict[cur_k][-1] = w
+  # only visit gold triples with the same relation name
+  gold_rel1_index = index_triples(gold_relation1, label_id)
   for i in range(0, len_test_rel1):
-    for j in range(0, len_gold_rel1):
-      if test_relation1[i][0].lower() == gold_relation1[j][0].lower():
-        w = node_weight_fn(test_relation1[i][2], gold_relation1[j][2])
-        var1_num = int(test_relation1[i][1][len(test_label):])
-        var2_num = int(gold_relation1[j][1][len(gold_label):])
-        candidate_match[var1_num].add(var2_num)
-        cur_k = (var1_num, var2_num)
-        if cur_k in weight_dict:
-          weight_dict[cur_k][-1] += w
-        else:
-          weight_dict[cur_k] = {}
-          weight_dict[cur_k][-1] = w
+    for j in gold_rel1_index.get(label_id(test_relation1[i][0]), ()):
+      w = node_weight_fn(test_relation1[i][2], gold_relation1[j][2])
+      var1_num = test_relation1[i][1]
+      var2_num = gold_relation1[j][1]
+      candidate_match[var1_num].add(var2_num)
+      cur_k = (var1_num, var2_num)
+      if cur_k in weight_dict:
+        weight_dict[cur_k][-1] += w
+      else:
+        weight_dict[cur_k] = {}
+        weight_dict[cur_k][-1] = w
 
+  # only visit gold triples whose relation can get a weight from
+  # edge_weight_fn, if it declares its label classes
+  edge_class = getattr(edge_weight_fn, 'label_class', no_label_class)
+  gold_rel2_index = index_triples(gold_relation2, edge_class)
   for i in range(0, len_test_rel2):
-    for j in range(0, len_gold_rel2):
+    for j in gold_rel2_index.get(edge_class(test_relation2[i][0]), ()):
       w = edge_weight_fn(test_relation2[i][0], gold_relation2[j][0])
       if w > 0:
-        var1_num_test = int(test_relation2[i][1][len(test_label):])
-        var1_num_gold = int(gold_relation2[j][1][len(gold_label):])
-        var2_num_test = int(test_relation2[i][2][len(test_label):])
-        var2_num_gold = int(gold_relation2[j][2][len(gold_label):])
+        var1_num_test = test_relation2[i][1]
+        var1_num_gold = gold_relation2[j][1]
+        var2_num_test = test_relation2[i][2]
+        var2_num_gold = gold_relation2[j][2]
         candidate_match[var1_num_test].add(var1_num_gold)
         candidate_match[var2_num_test].add(var2_num_gold)
         cur_k1 = (var1_num_test, var1_num_gold)
@@ -323,16 +590,19 @@ def get_random_sol(candidate):
   return result
 
 
-def compute_match(match, weight_dict):
+def compute_match(match, weight_dict, memo=None):
   """Given a variable match, compute match number based on weight_dict.
      Args:
          match: a list of number in gold set, len(match)= number of test instance
+         memo: optional MatchMemo of match numbers already computed
      Returns:
          matching triple number
      Complexity: O(m*n) , m is the length of test instance, n is the length of gold instance"""
   # remember matching number of the previous matching we investigated
-  if tuple(match) in match_num_dict:
-    return match_num_dict[tuple(match)]
+  if memo is not None:
+    match_num = memo.get(match)
+    if match_num is not None:
+      return match_num
   match_num = 0
   for i, m in enumerate(match):
     if m == -1:
@@ -348,11 +618,12 @@ def compute_match(match, weight_dict):
         continue
       elif match[k[0]] == k[1]:
         match_num += weight_dict[cur_m][k]
-  match_num_dict[tuple(match)] = match_num
+  if memo is not None:
+    memo.put(match, match_num)
   return match_num
 
 
-def move_gain(match, i, m, nm, weight_dict, match_num):
+def move_gain(match, i, m, nm, weight_dict, match_num, memo=None):
   """Compute the triple match number gain by the move operation
      Args:
          match: current match list
@@ -361,21 +632,26 @@ def move_gain(match, i, m, nm, weight_dict, match_num):
          nm: new mapped id
          weight_dict: weight dictionary
          match_num: the original matching number
+         memo: optional MatchMemo of match numbers already computed
       Returns:
          the gain number (might be negative)"""
   cur_m = (i, nm)
   old_m = (i, m)
   new_match = match[:]
   new_match[i] = nm
-  if tuple(new_match) in match_num_dict:
-    return match_num_dict[tuple(new_match)] - match_num
+  if memo is not None:
+    new_match_num = memo.get(new_match)
+    if new_match_num is not None:
+      return new_match_num - match_num
   gain = 0
+  # relations of the new pair are looked up in the new match, so that a
+  # self-loop on i does not count its other end at the old gold variable
   if cur_m in weight_dict:
     gain += weight_dict[cur_m][-1]
     for k in weight_dict[cur_m]:
       if k == -1:
         continue
-      elif match[k[0]] == k[1]:
+      elif new_match[k[0]] == k[1]:
         gain += weight_dict[cur_m][k]
   if old_m in weight_dict:
     gain -= weight_dict[old_m][-1]
@@ -384,11 +660,12 @@ def move_gain(match, i, m, nm, weight_dict, match_num):
         continue
       elif match[k[0]] == k[1]:
         gain -= weight_dict[old_m][k]
-  match_num_dict[tuple(new_match)] = match_num + gain
+  if memo is not None:
+    memo.put(new_match, match_num + gain)
   return gain
 
 
-def swap_gain(match, i, m, j, m2, weight_dict, match_num):
+def swap_gain(match, i, m, j, m2, weight_dict, match_num, memo=None):
   """Compute the triple match number gain by the swap operation
      Args:
          match: current match list
@@ -398,6 +675,7 @@ def swap_gain(match, i, m, j, m2, weight_dict, match_num):
          m2: the original mapped variable of j
          weight_dict: weight dictionary
          match_num: the original matching number
+         memo: optional MatchMemo of match numbers already computed
       Returns:
          the gain number (might be negative)"""
   new_match = match[:]
@@ -417,7 +695,7 @@ def swap_gain(match, i, m, j, m2, weight_dict, match_num):
         continue
       elif k[0] == j:
         continue
-      elif match[k[0]] == k[1]:
+      elif new_match[k[0]] == k[1]:
         gain += weight_dict[cur_m][k]
   if cur_m2 in weight_dict:
     gain += weight_dict[cur_m2][-1]
@@ -426,7 +704,7 @@ def swap_gain(match, i, m, j, m2, weight_dict, match_num):
         continue
       elif k[0] == i:
         continue
-      elif match[k[0]] == k[1]:
+      elif new_match[k[0]] == k[1]:
         gain += weight_dict[cur_m2][k]
   if old_m in weight_dict:
     gain -= weight_dict[old_m][-1]
@@ -448,7 +726,8 @@ def swap_gain(match, i, m, j, m2, weight_dict, match_num):
         continue
       elif match[k[0]] == k[1]:
         gain -= weight_dict[old_m2][k]
-  match_num_dict[tuple(new_match)] = match_num + gain
+  if memo is not None:
+    memo.put(new_match, match_num + gain)
   return gain
 
 
@@ -457,7 +736,8 @@ def get_best_gain(
     candidate_match,
     weight_dict,
     gold_len,
-        start_match_num):
+        start_match_num,
+        memo=None):
   """ hill-climbing method to return the best gain swap/move can get
     Args:
         match: the initial variable mapping
@@ -465,6 +745,7 @@ def get_best_gain(
         weight_dict: the weight dictionary
         gold_len: the number of the variables in file 2
         start_match_num: the initial match number
+        memo: optional MatchMemo of match numbers already computed
     Returns:
         the best gain we can get via swap/move operation"""
   largest_gain = 0
@@ -483,7 +764,7 @@ def get_best_gain(
     for nm in unmatch_list:
       if nm in candidate_match[i]:
         #(i,m) -> (i,nm)
-        gain = move_gain(match, i, m, nm, weight_dict, start_match_num)
+        gain = move_gain(match, i, m, nm, weight_dict, start_match_num, memo)
         if verbose:
           new_match = match[:]
           new_match[i] = nm
@@ -504,7 +785,7 @@ def get_best_gain(
       new_match = match[:]
       new_match[i] = m2
       new_match[j] = m
-      sw_gain = swap_gain(match, i, m, j, m2, weight_dict, start_match_num)
+      sw_gain = swap_gain(match, i, m, j, m2, weight_dict, start_match_num, memo)
       if verbose:
         new_match = match[:]
         new_match[i] = m2
@@ -531,90 +812,925 @@ def get_best_gain(
   return (largest_match_num, cur_match)
 
 
+def hill_climb(match, match_num, best_gain_fn, deadline=None):
+  """ Apply the best swap/move step until no step gains anything
+    Args:
+        match: the initial variable mapping
+        match_num: the initial match number
+        best_gain_fn: one step, (match, match_num) -> (new match_num, new match)
+        deadline: time.time() after which no further step is taken, or None
+    Returns:
+        (match number, match) at the local optimum, or where the deadline
+        stopped the climb"""
+  (largest_match_num, cur_match) = best_gain_fn(match, match_num)
+  if verbose:
+    print >> sys.stderr, "Largest match number after the hill-climbing", largest_match_num
+  # hill-climbing until there will be no gain if we generate a new variable
+  # mapping
+  while largest_match_num > match_num:
+    match_num = largest_match_num
+    if deadline is not None and time.time() >= deadline:
+      break
+    (largest_match_num, cur_match) = best_gain_fn(cur_match, match_num)
+    if verbose:
+      print >> sys.stderr, "Largest match number after the hill-climbing", largest_match_num
+  return (match_num, cur_match)
+
+
+class MatchContributions(object):
+  """ What each (test var, gold var) pair contributes given a match, kept up to
+      date as the match changes. contribution[(i, j)] is the weight of mapping
+      i to j with every other variable where the match puts it. """
+
+  def __init__(self, weight_dict, match):
+    self.weight_dict = weight_dict
+    self.match = match[:]
+    self.contribution = {}
+    for (cur_m, neighbours) in weight_dict.items():
+      total = neighbours[-1]
+      for k in neighbours:
+        if k != -1 and k[0] != cur_m[0] and self.match[k[0]] == k[1]:
+          total += neighbours[k]
+      self.contribution[cur_m] = total
+
+  def update(self, i, old, new):
+    # i moved from old to new: adjust every pair related to either
+    contribution = self.contribution
+    for (m, sign) in (((i, old), -1), ((i, new), 1)):
+      if m not in self.weight_dict:
+        continue
+      for (k, w) in self.weight_dict[m].items():
+        if k != -1 and k[0] != i:
+          contribution[k] = contribution.get(k, 0) + sign * w
+
+  def move_gain(self, i, nm):
+    """ Gain of remapping i to nm """
+    return self.contribution.get((i, nm), 0) - \
+        self.contribution.get((i, self.match[i]), 0)
+
+  def swap_gain(self, i, j):
+    """ Gain of exchanging the gold variables of i and j """
+    contribution = self.contribution
+    (m, m2) = (self.match[i], self.match[j])
+    # the contributions count the relation between i and j as if the other
+    # one stayed put, fix it up
+    gain = contribution.get((i, m2), 0) + contribution.get((j, m), 0) - \
+        contribution.get((i, m), 0) - contribution.get((j, m2), 0)
+    old_pairs = self.weight_dict.get((i, m))
+    if old_pairs:
+      gain += old_pairs.get((j, m2), 0) - old_pairs.get((j, m), 0)
+    new_pairs = self.weight_dict.get((i, m2))
+    if new_pairs:
+      gain += new_pairs.get((j, m), 0) - new_pairs.get((j, m2), 0)
+    return gain
+
+  def move(self, i, nm):
+    self.update(i, self.match[i], nm)
+    self.match[i] = nm
+
+  def swap(self, i, j):
+    (m, m2) = (self.match[i], self.match[j])
+    (self.match[i], self.match[j]) = (m2, m)
+    self.update(i, m, m2)
+    self.update(j, m2, m)
+
+
+def incremental_climb(match, candidate_match, weight_dict, gold_len, match_num,
+    deadline=None):
+  """ Hill-climbing with the same steps as get_best_gain, but keeping a table of
+      what each (test var, gold var) pair contributes given the current match.
+      A move or swap then only updates the pairs related to the changed
+      variables, and each candidate step costs a few lookups.
+    Args:
+        match: the initial variable mapping
+        candidate_match: the match candidates list
+        weight_dict: the weight dictionary
+        gold_len: the number of the variables in file 2
+        match_num: the initial match number
+        deadline: time.time() after which no further step is taken, or None
+    Returns:
+        (match number, match) at the local optimum, or where the deadline
+        stopped the climb"""
+  table = MatchContributions(weight_dict, match)
+  match = table.match
+  contribution = table.contribution
+  no_pairs = {}
+  while deadline is None or time.time() < deadline:
+    largest_gain = 0
+    change_list = []
+    matched_gold = set(match)
+    current = [contribution.get((i, m), 0) for (i, m) in enumerate(match)]
+    for i, m in enumerate(match):
+      for nm in candidate_match[i]:
+        if nm in matched_gold:
+          continue
+        gain = contribution.get((i, nm), 0) - current[i]
+        if gain > largest_gain:
+          largest_gain = gain
+          change_list = [i, nm]
+          swap = False
+    for i, m in enumerate(match):
+      old_pairs = weight_dict.get((i, m), no_pairs)
+      for j in range(i + 1, len(match)):
+        m2 = match[j]
+        # i takes m2 and j takes m; fix up the relation between i and j,
+        # which the contributions count as if the other one stayed put
+        gain = contribution.get((i, m2), 0) + contribution.get((j, m), 0) - \
+            current[i] - current[j] + \
+            old_pairs.get((j, m2), 0) - old_pairs.get((j, m), 0)
+        new_pairs = weight_dict.get((i, m2))
+        if new_pairs:
+          gain += new_pairs.get((j, m), 0) - new_pairs.get((j, m2), 0)
+        if gain > largest_gain:
+          largest_gain = gain
+          change_list = [i, j]
+          swap = True
+    if change_list == []:
+      return (match_num, match)
+    match_num += largest_gain
+    if swap:
+      table.swap(*change_list)
+    else:
+      table.move(*change_list)
+    if verbose:
+      print >> sys.stderr, "Largest match number after the hill-climbing", match_num
+  return (match_num, match)
+
+
+def sample_step(table, candidate_match, owner, movable):
+  """ Pick a random step: a test variable and one of its candidates, which is
+      a move if the candidate is free and a swap with its owner otherwise
+    Args:
+        table: MatchContributions of the current match
+        candidate_match: the match candidates list
+        owner: dict from matched gold var to the test var mapped to it
+        movable: list of the test vars with candidates, as lists
+    Returns:
+        (i, new gold var, test var to swap with or None, gain), or None if
+        the sampled candidate is where i already maps"""
+  (i, candidates) = random.choice(movable)
+  nm = random.choice(candidates)
+  if nm == table.match[i]:
+    return None
+  j = owner.get(nm)
+  if j is None:
+    return (i, nm, None, table.move_gain(i, nm))
+  return (i, nm, j, table.swap_gain(i, j))
+
+
+def take_step(table, owner, step):
+  """ Apply a step from sample_step, keeping owner up to date """
+  (i, nm, j, gain) = step
+  m = table.match[i]
+  if j is None:
+    table.move(i, nm)
+    owner.pop(m, None)
+  else:
+    table.swap(i, j)
+    if m != -1:
+      owner[m] = j
+  owner[nm] = i
+
+
+def anneal_climb(match, candidate_match, weight_dict, match_num,
+    max_evals=None, deadline=None, target=None):
+  """ Simulated annealing: sample one step at a time, always take it if it
+      does not lose anything, and otherwise with a probability that shrinks
+      with the loss and with the temperature, which cools geometrically over
+      the evaluation budget
+    Args:
+        match: the initial variable mapping
+        candidate_match: the match candidates list
+        weight_dict: the weight dictionary
+        match_num: the initial match number
+        max_evals: number of sampled steps (Default: SAMPLE_EVALS per test var)
+        deadline: time.time() after which no further step is taken, or None
+        target: match number at which to stop, e.g. an upper bound, or None
+    Returns:
+        (match number, match) of the best match seen"""
+  table = MatchContributions(weight_dict, match)
+  movable = [(i, list(c)) for (i, c) in enumerate(candidate_match) if c]
+  if max_evals is None:
+    max_evals = SAMPLE_EVALS * len(candidate_match)
+  if not movable or max_evals <= 0:
+    return (match_num, match[:])
+  owner = dict((m, i) for (i, m) in enumerate(table.match) if m != -1)
+  (best_match_num, best_match) = (match_num, match[:])
+  temp = ANNEAL_START_TEMP
+  cooling = (ANNEAL_END_TEMP / ANNEAL_START_TEMP) ** (1.0 / max_evals)
+  for evals in xrange(max_evals):
+    temp *= cooling
+    if deadline is not None and evals % 256 == 0 and time.time() >= deadline:
+      break
+    step = sample_step(table, candidate_match, owner, movable)
+    if step is None:
+      continue
+    gain = step[3]
+    if gain < 0 and random.random() >= math.exp(gain / temp):
+      continue
+    take_step(table, owner, step)
+    match_num += gain
+    if match_num > best_match_num + EPSILON:
+      (best_match_num, best_match) = (match_num, table.match[:])
+      if target is not None and best_match_num >= target - EPSILON:
+        break
+  if verbose:
+    print >> sys.stderr, "Best match number after annealing", best_match_num
+  return (compute_match(best_match, weight_dict), best_match)
+
+
+def tabu_climb(match, candidate_match, weight_dict, match_num,
+    max_evals=None, deadline=None, target=None):
+  """ Tabu search: each iteration samples TABU_SAMPLE steps and takes the best
+      one, even if it loses. A variable may not go back to the gold variable
+      it left in the last TABU_TENURE iterations, unless the step beats the
+      best match.
+    Args:
+        match: the initial variable mapping
+        candidate_match: the match candidates list
+        weight_dict: the weight dictionary
+        match_num: the initial match number
+        max_evals: number of sampled steps (Default: SAMPLE_EVALS per test var)
+        deadline: time.time() after which no further step is taken, or None
+        target: match number at which to stop, e.g. an upper bound, or None
+    Returns:
+        (match number, match) of the best match seen"""
+  table = MatchContributions(weight_dict, match)
+  movable = [(i, list(c)) for (i, c) in enumerate(candidate_match) if c]
+  if max_evals is None:
+    max_evals = SAMPLE_EVALS * len(candidate_match)
+  if not movable:
+    return (match_num, match[:])
+  owner = dict((m, i) for (i, m) in enumerate(table.match) if m != -1)
+  (best_match_num, best_match) = (match_num, match[:])
+  # tabu_until[(i, m)]: iteration until which i may not map to m again
+  tabu_until = {}
+  evals = 0
+  iteration = 0
+  while evals < max_evals:
+    if deadline is not None and time.time() >= deadline:
+      break
+    iteration += 1
+    best_step = None
+    for k in range(min(TABU_SAMPLE, max_evals - evals)):
+      evals += 1
+      step = sample_step(table, candidate_match, owner, movable)
+      if step is None:
+        continue
+      (i, nm, j, gain) = step
+      tabu = tabu_until.get((i, nm), 0) > iteration or \
+          (j is not None and tabu_until.get((j, table.match[i]), 0) > iteration)
+      if tabu and match_num + gain <= best_match_num + EPSILON:
+        continue
+      if best_step is None or gain > best_step[3]:
+        best_step = step
+    if best_step is None:
+      continue
+    (i, nm, j, gain) = best_step
+    tabu_until[(i, table.match[i])] = iteration + TABU_TENURE
+    if j is not None:
+      tabu_until[(j, nm)] = iteration + TABU_TENURE
+    take_step(table, owner, best_step)
+    match_num += gain
+    if match_num > best_match_num + EPSILON:
+      (best_match_num, best_match) = (match_num, table.match[:])
+      if target is not None and best_match_num >= target - EPSILON:
+        break
+  if verbose:
+    print >> sys.stderr, "Best match number after tabu search", best_match_num
+  return (compute_match(best_match, weight_dict), best_match)
+
+
+# Search engines run one climb of get_fh: engine(match, match_num, pool,
+# deadline) -> (match number, match). pool is a dict with the candidate_match,
+# weight_dict (None with the array backend), gold_len, best_gain_fn (one
+# steepest-ascent step), upper_bound (see match_upper_bound) and max_evals
+# option of get_fh.
+def hill_engine(match, match_num, pool, deadline):
+  return hill_climb(match, match_num, pool["best_gain_fn"], deadline)
+
+
+def incremental_engine(match, match_num, pool, deadline):
+  return incremental_climb(match, pool["candidate_match"], pool["weight_dict"],
+                           pool["gold_len"], match_num, deadline)
+
+
+def anneal_engine(match, match_num, pool, deadline):
+  return anneal_climb(match, pool["candidate_match"], pool["weight_dict"],
+                      match_num, pool["max_evals"], deadline,
+                      pool["upper_bound"])
+
+
+def tabu_engine(match, match_num, pool, deadline):
+  return tabu_climb(match, pool["candidate_match"], pool["weight_dict"],
+                    match_num, pool["max_evals"], deadline, pool["upper_bound"])
+
+SEARCH_ENGINES = {"hill": hill_engine,
+                  "incremental": incremental_engine,
+                  "anneal": anneal_engine,
+                  "tabu": tabu_engine}
+
+
+class Climber(object):
+  """
+  Climbs of one AMR pair from given start matches, with its candidate pool,
+  search engine and match number memo. Pickling keeps only the pool and
+  options, so that a restart worker process can climb for any AMR pair; the
+  unpickled Climber starts with an empty memo.
+  """
+
+  def __init__(self, engine, candidate_match, weight_dict, weights, gold_len,
+               upper_bound, max_evals, memo_size, deadline):
+    self.engine = engine
+    self.candidate_match = candidate_match
+    self.weight_dict = weight_dict  # None with the array backend
+    self.weights = weights  # WeightArrays with the array backend, or None
+    self.gold_len = gold_len
+    self.upper_bound = upper_bound
+    self.max_evals = max_evals
+    self.memo_size = memo_size
+    self.deadline = deadline
+    self.setup()
+
+  def setup(self):
+    self.memo = MatchMemo(self.memo_size)
+    self.pool = {"candidate_match": self.candidate_match,
+                 "weight_dict": self.weight_dict,
+                 "gold_len": self.gold_len,
+                 "best_gain_fn": self.best_gain,
+                 "upper_bound": self.upper_bound,
+                 "max_evals": self.max_evals}
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    del state["memo"]
+    del state["pool"]
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.setup()
+
+  def match_num(self, match):
+    if self.weights is not None:
+      return self.weights.match_num(match)
+    return compute_match(match, self.weight_dict, self.memo)
+
+  def best_gain(self, match, match_num):
+    if self.weights is not None:
+      return weight_array.get_best_gain_array(match, self.weights, match_num)
+    return get_best_gain(match, self.candidate_match, self.weight_dict,
+                         self.gold_len, match_num, self.memo)
+
+  def climb(self, start_match):
+    """Climb from start_match, returning (match number, match)"""
+    # first match_num, and store the match in memory
+    match_num = self.match_num(start_match)
+    if verbose:
+      print >> sys.stderr, "starting point match num:", match_num
+      print >> sys.stderr, "start match", start_match
+    # hill-climbing
+    return self.engine(start_match, match_num, self.pool, self.deadline)
+
+
+def estimate_weights(weight_dict):
+  """ Optimistic weight of mapping each test variable to each gold variable:
+      the unary weight plus half of the best relation weight towards each
+      other test variable (the other half goes to the other end)
+    Args:
+        weight_dict: the weight dictionary
+    Returns:
+        dict from (test var, gold var) to the estimate"""
+  estimates = {}
+  for ((i, j), neighbours) in weight_dict.items():
+    best_pair = {}
+    for (k, w) in neighbours.items():
+      if k != -1 and k[0] != i:
+        best_pair[k[0]] = max(best_pair.get(k[0], 0), w)
+    estimates[(i, j)] = neighbours[-1] + sum(best_pair.values()) / 2.0
+  return estimates
+
+
+def match_upper_bound(weight_dict, test_len, gold_len):
+  """ Upper bound on the match number of any match over the candidate pool.
+      Each test variable is given its best gold variable by estimate_weights.
+      The same is done for each gold variable, and the smaller sum is
+      returned.
+    Args:
+        weight_dict: the weight dictionary
+        test_len: the number of the variables in file 1
+        gold_len: the number of the variables in file 2
+    Returns:
+        the upper bound"""
+  test_best = [0] * test_len
+  gold_best = [0] * gold_len
+  for ((i, j), score) in estimate_weights(weight_dict).items():
+    test_best[i] = max(test_best[i], score)
+    gold_best[j] = max(gold_best[j], score)
+  return min(sum(test_best), sum(gold_best))
+
+
+def linear_assignment(weights):
+  """ Hungarian algorithm: the assignment of rows to columns with the highest
+      total weight, each row and column used at most once
+    Args:
+        weights: list of rows of weights, at most as many rows as columns
+    Returns:
+        list of the column of each row"""
+  row_num = len(weights)
+  col_num = len(weights[0]) if row_num else 0
+  inf = float("inf")
+  # potentials and matching over 1-based rows and columns, column 0 is a
+  # sentinel holding the row being added
+  row_pot = [0.0] * (row_num + 1)
+  col_pot = [0.0] * (col_num + 1)
+  col_row = [0] * (col_num + 1)
+  way = [0] * (col_num + 1)
+  for row in range(1, row_num + 1):
+    col_row[0] = row
+    col = 0
+    min_slack = [inf] * (col_num + 1)
+    used = [False] * (col_num + 1)
+    while True:
+      used[col] = True
+      cur_row = col_row[col]
+      cur_weights = weights[cur_row - 1]
+      delta = inf
+      next_col = 0
+      for j in range(1, col_num + 1):
+        if used[j]:
+          continue
+        slack = -cur_weights[j - 1] - row_pot[cur_row] - col_pot[j]
+        if slack < min_slack[j]:
+          min_slack[j] = slack
+          way[j] = col
+        if min_slack[j] < delta:
+          delta = min_slack[j]
+          next_col = j
+      for j in range(0, col_num + 1):
+        if used[j]:
+          row_pot[col_row[j]] += delta
+          col_pot[j] -= delta
+        else:
+          min_slack[j] -= delta
+      col = next_col
+      if col_row[col] == 0:
+        break
+    # flip the augmenting path
+    while col != 0:
+      prev_col = way[col]
+      col_row[col] = col_row[prev_col]
+      col = prev_col
+  result = [-1] * row_num
+  for j in range(1, col_num + 1):
+    if col_row[j] != 0:
+      result[col_row[j] - 1] = j - 1
+  return result
+
+
+def assignment_match(candidate_match, estimates, gold_len):
+  """Initialize match by the linear assignment with the highest total of
+     estimated weights, then give every unmatched test variable a free
+     candidate if there is one
+     Args:
+         candidate_match: candidate variable match list
+         estimates: dict from (test var, gold var) to weight, e.g. from
+             estimate_weights
+         gold_len: the number of the variables in file 2
+     Returns:
+         intialized match result"""
+  test_len = len(candidate_match)
+  rows = [[estimates.get((i, j), 0) for j in range(gold_len)]
+          for i in range(test_len)]
+  if test_len <= gold_len:
+    result = linear_assignment(rows)
+  else:
+    result = [-1] * test_len
+    for (j, i) in enumerate(linear_assignment(zip(*rows))):
+      result[i] = j
+  matched_gold = set()
+  for (i, m) in enumerate(result):
+    if m not in candidate_match[i]:
+      result[i] = -1
+    else:
+      matched_gold.add(m)
+  for (i, m) in enumerate(result):
+    if m != -1:
+      continue
+    for j in sorted(candidate_match[i]):
+      if j not in matched_gold:
+        result[i] = j
+        matched_gold.add(j)
+        break
+  return result
+
+
+def exact_search_space(candidate_match):
+  """ log10 of the number of ways to give each test variable one of its
+      candidates or none, an upper bound on the matches exact_match searches """
+  return sum(math.log10(len(candidates) + 1) for candidates in candidate_match)
+
+
+def exact_match(candidate_match, weight_dict, match, match_num, node_limit=None,
+    deadline=None):
+  """ Branch and bound search for the best match over the candidate pool.
+      Variables are assigned one by one; a relation between two variables is
+      counted when the later one is assigned. A partial match is dropped when
+      its match number plus an upper bound for the remaining variables cannot
+      beat the best match so far. The bound of a variable is its best
+      candidate assuming every relation to an earlier variable matches, so it
+      never underestimates.
+      The search gives up once it has expanded node_limit partial matches, or
+      once the deadline has passed.
+    Args:
+        candidate_match: the match candidates list
+        weight_dict: the weight dictionary
+        match: a match to start from, e.g. the result of a hill-climbing
+        match_num: the match number of match
+        node_limit: the largest number of partial matches to expand, or None
+        deadline: time.time() after which the search gives up, or None
+    Returns:
+        (match number, match) of an optimal match, or None if the search gave up"""
+  test_len = len(candidate_match)
+  no_pairs = {-1: 0}
+
+  def potential(i):
+    # best weight i can take part in, relations counted fully
+    best = 0
+    for j in candidate_match[i]:
+      best = max(best, sum(weight_dict.get((i, j), no_pairs).values()))
+    return best
+
+  # assign the heaviest variables first, so that the bound tightens early
+  order = sorted(range(test_len), key=potential, reverse=True)
+  position = [0] * test_len
+  for (t, i) in enumerate(order):
+    position[i] = t
+  # options[t]: (gold var, unary weight, relations to earlier variables) for
+  # each candidate of the t-th variable, most promising first
+  options = []
+  bounds = []
+  for (t, i) in enumerate(order):
+    cur_options = []
+    for j in candidate_match[i]:
+      neighbours = weight_dict.get((i, j), no_pairs)
+      earlier = []
+      best_pair = {}
+      for (k, w) in neighbours.items():
+        if k != -1 and k[0] != i and position[k[0]] < t:
+          earlier.append((k[0], k[1], w))
+          best_pair[k[0]] = max(best_pair.get(k[0], 0), w)
+      cur_options.append((neighbours[-1] + sum(best_pair.values()),
+                          j, neighbours[-1], earlier))
+    cur_options.sort(reverse=True)
+    bounds.append(max([0] + [o[0] for o in cur_options]))
+    options.append([o[1:] for o in cur_options])
+  # remaining[t]: bound for the variables from position t on
+  remaining = [0] * (test_len + 1)
+  for t in range(test_len - 1, -1, -1):
+    remaining[t] = remaining[t + 1] + bounds[t]
+
+  best_num = match_num
+  best_match = match[:]
+  cur_match = [-1] * test_len
+  matched_gold = set()
+  nodes = 0
+  # depth-first search with an explicit stack, so that large AMRs do not
+  # run out of recursion depth. A frame [t, match number, next option] is
+  # the assignment of the t-th variable; the option after its candidates
+  # leaves it unmatched. call is the partial match to expand next.
+  stack = []
+  call = (0, 0)
+  while True:
+    if call is not None:
+      (t, cur_num) = call
+      call = None
+      if cur_num + remaining[t] > best_num + EPSILON:
+        nodes += 1
+        if (node_limit is not None and nodes > node_limit) or \
+            (deadline is not None and time.time() >= deadline):
+          return None
+        if t == test_len:
+          best_num = cur_num
+          best_match = cur_match[:]
+        else:
+          stack.append([t, cur_num, 0])
+    if not stack:
+      break
+    frame = stack[-1]
+    (t, cur_num, k) = frame
+    i = order[t]
+    if cur_match[i] != -1:
+      # back from the option tried last
+      matched_gold.discard(cur_match[i])
+      cur_match[i] = -1
+    cur_options = options[t]
+    while k < len(cur_options) and cur_options[k][0] in matched_gold:
+      k += 1
+    frame[2] = k + 1
+    if k < len(cur_options):
+      (j, unary, earlier) = cur_options[k]
+      num = cur_num + unary
+      for (m, l, w) in earlier:
+        if cur_match[m] == l:
+          num += w
+      cur_match[i] = j
+      matched_gold.add(j)
+      call = (t + 1, num)
+    elif k == len(cur_options):
+      call = (t + 1, cur_num)
+    else:
+      stack.pop()
+  return (best_num, best_match)
+
+
 def get_fh(test_instance, test_relation1, test_relation2,
     gold_instance, gold_relation1, gold_relation2,
     test_label, gold_label,
     node_weight_fn=dflt_label_weighter, edge_weight_fn=dflt_label_weighter,
-    iter_num=5):
+    iter_num=5, backend="dict", search="hill", memo_size=MEMO_SIZE, jobs=1,
+    exact_limit=EXACT_LIMIT, patience=0, min_iter=1, time_limit=None,
+    time_budget=None, init="greedy", max_evals=None, stats=None):
   """Get the f-score given two sets of triples
      Args:
-         iter_num: iteration number of heuristic search
+         iter_num: iteration number of heuristic search (the most climbs run)
+         backend: "dict" for the weight_dict pool, or "array" for the NumPy pool
+             with vectorized move/swap gains
+         search: name of a search engine in SEARCH_ENGINES, or an engine
+             function (see hill_engine): "hill" for steepest ascent,
+             "incremental" for steepest ascent with incremental gain
+             bookkeeping, "anneal" for simulated annealing or "tabu" for tabu
+             search (all but "hill" need the dict backend); with jobs
+             above 1, an engine function must be picklable
+         memo_size: bound on the match number memo kept during this call
+             (0 disables it)
+         jobs: number of processes running the restarts in parallel, in a
+             pool kept for later calls (see get_restart_pool)
+         exact_limit: node budget of the branch and bound search tried after
+             the first climb on pairs with at most EXACT_MAX_VARS test
+             variables and a search space (see exact_search_space) of at most
+             EXACT_MAX_SPACE; if it runs out, or the pair is larger, the
+             restarts run as usual (0 disables the exact search)
+         patience: stop once this many climbs in a row did not improve the
+             best match (0 runs all iter_num climbs)
+         min_iter: number of climbs run before patience or time_limit may
+             stop the search
+         time_limit: seconds after which no new climb is started, or None
+         time_budget: seconds after which the search stops, even in the middle
+             of a climb, and returns the best match so far, or None
+         init: start of the first climb: "greedy" (init_match, by node label
+             weights) or "hungarian" (assignment_match, by unary and
+             estimated relation weights)
+         max_evals: steps sampled per climb by the "anneal" and "tabu"
+             searches, or None for their default
+         stats: optional dict, filled with search statistics (memo hits/misses,
+             iterations run, whether the match is exact, whether the time
+             budget cut the search short)
          test_instance: instance triples of AMR 1
          test_relation1: relation triples of AMR 1 (one-variable)
          test_relation2: relation triples of AMR 2 (two-variable)
          gold_instance: instance triples of AMR 2
          gold_relation1: relation triples of AMR 2 (one-variable)
          gold_relation2: relation triples of AMR 2 (two-variable)
-         test_label: prefix label for AMRe 1
-         gold_label: prefix label for AMR 2
+         test_label: prefix label for AMRe 1, or None if its variables are
+             indices (AMR.get_indexed_triples)
+         gold_label: prefix label for AMR 2, or None likewise
       Returns:
          best_match: the variable mapping which results in the best matching triple number
          best_match_num: the highest matching number
         """
+  start_time = time.time()
+  deadline = None
+  if time_budget is not None:
+    deadline = start_time + time_budget
+
+  def out_of_time():
+    return deadline is not None and time.time() >= deadline
+
+  if callable(search):
+    engine = search
+  elif search in SEARCH_ENGINES:
+    engine = SEARCH_ENGINES[search]
+  else:
+    raise ValueError("Unknown search: %s" % search)
+  if backend == "array" and search in SEARCH_ENGINES and search != "hill":
+    raise ValueError("The array backend only supports hill search")
+  if init not in ("greedy", "hungarian"):
+    raise ValueError("Unknown init: %s" % init)
   # compute candidate pool
-  (candidate_match,
-   weight_dict) = compute_pool(test_instance, test_relation1, test_relation2,
-                               gold_instance, gold_relation1, gold_relation2,
-                               test_label, gold_label,
-                               node_weight_fn, edge_weight_fn)
+  if backend == "array":
+    if weight_array is None:
+      raise ImportError("The array backend requires numpy")
+    (candidate_match,
+     weights) = weight_array.compute_pool_array(test_instance, test_relation1, test_relation2,
+                                                gold_instance, gold_relation1, gold_relation2,
+                                                test_label, gold_label,
+                                                node_weight_fn, edge_weight_fn)
+    weight_dict = None
+    upper_bound = weights.upper_bound()
+    estimate_fn = weights.estimate_weights
+  else:
+    (candidate_match,
+     weight_dict) = compute_pool(test_instance, test_relation1, test_relation2,
+                                 gold_instance, gold_relation1, gold_relation2,
+                                 test_label, gold_label,
+                                 node_weight_fn, edge_weight_fn)
+    weights = None
+    upper_bound = match_upper_bound(weight_dict, len(test_instance),
+                                    len(gold_instance))
+
+    def estimate_fn():
+      return estimate_weights(weight_dict)
+
+  climber = Climber(engine, candidate_match, weight_dict, weights,
+                    len(gold_instance), upper_bound, max_evals, memo_size,
+                    deadline)
+  memo = climber.memo
+  match_num_fn = climber.match_num
+  climb_from = climber.climb
   best_match_num = 0
   best_match = [-1] * len(test_instance)
 
-  # best lexical match
-  if iter_num == 0:
-    start_match = init_match(
+  def first_match():
+    if init == "hungarian":
+      return assignment_match(candidate_match, estimate_fn(),
+                              len(gold_instance))
+    return init_match(
         candidate_match,
         test_instance,
         gold_instance,
         node_weight_fn)
-    return(start_match, compute_match(start_match, weight_dict))
 
-  for i in range(0, iter_num):
-    if verbose:
-      print >> sys.stderr, "Iteration", i
-    if i == 0:
-      # smart initialization
-      start_match = init_match(
-          candidate_match,
-          test_instance,
-          gold_instance,
-          node_weight_fn)
+  # best lexical match
+  if iter_num == 0:
+    start_match = first_match()
+    start_match_num = match_num_fn(start_match)
+    record_stats(stats, memo, 0)
+    return(start_match, start_match_num)
+
+  def start_matches(first):
+    for i in range(first, iter_num):
+      if verbose:
+        print >> sys.stderr, "Iteration", i
+      if i == 0:
+        # smart initialization
+        yield first_match()
+      else:
+        # random initialization
+        yield get_random_sol(candidate_match)
+
+  if verbose:
+    print >> sys.stderr, "Match number upper bound:", upper_bound
+  first = 0
+  if exact_limit > 0 and len(candidate_match) <= EXACT_MAX_VARS and \
+      exact_search_space(candidate_match) <= EXACT_MAX_SPACE:
+    # the first climb gives branch and bound a good match to beat
+    (best_match_num, best_match) = climb_from(next(start_matches(0)))
+    # score the match afresh instead of trusting the running total of the
+    # climb, before taking it as optimal or as the bound to beat
+    if weights is not None:
+      best_match_num = weights.match_num(best_match)
     else:
-      # random initialization
-      start_match = get_random_sol(candidate_match)
-    # first match_num, and store the match in memory
-    match_num = compute_match(start_match, weight_dict)
-   # match_num_dict[tuple(start_match)]=match_num
-    if verbose:
-      print >> sys.stderr, "starting point match num:", match_num
-      print >> sys.stderr, "start match", start_match
-    # hill-climbing
-    (largest_match_num,
-     cur_match) = get_best_gain(start_match,
-                                candidate_match,
-                                weight_dict,
-                                len(gold_instance),
-                                match_num)
-    if verbose:
-      print >> sys.stderr, "Largest match number after the hill-climbing", largest_match_num
-   # match_num=largest_match_num
-    # hill-climbing until there will be no gain if we generate a new variable
-    # mapping
-    while largest_match_num > match_num:
-      match_num = largest_match_num
-      (largest_match_num,
-       cur_match) = get_best_gain(cur_match,
-                                  candidate_match,
-                                  weight_dict,
-                                  len(gold_instance),
-                                  match_num)
+      best_match_num = compute_match(best_match, weight_dict)
+    if best_match_num >= upper_bound - EPSILON:
+      record_stats(stats, memo, 1, True)
+      return (best_match, best_match_num)
+    if backend == "array":
+      weight_dict = weights.to_dict()
+    result = exact_match(candidate_match, weight_dict, best_match,
+                         best_match_num, exact_limit, deadline)
+    if result is not None:
       if verbose:
-        print >> sys.stderr, "Largest match number after the hill-climbing", largest_match_num
+        print >> sys.stderr, "Exact match number", result[0]
+      record_stats(stats, memo, 1, True)
+      return (result[1], result[0])
+    if out_of_time():
+      record_stats(stats, memo, 1, truncated=True)
+      return (best_match, best_match_num)
+    first = 1
+  if jobs > 1 and iter_num - first > 1:
+    climbs = parallel_climbs(start_matches(first), climber, jobs)
+  else:
+    climbs = (climb_from(start_match) for start_match in start_matches(first))
+  iterations = first
+  no_gain = 0
+  truncated = False
+  for (match_num, cur_match) in climbs:
+    iterations += 1
     if match_num > best_match_num:
       best_match = cur_match[:]
       best_match_num = match_num
+      no_gain = 0
+    else:
+      no_gain += 1
+    if best_match_num >= upper_bound - EPSILON:
+      # no restart can do better
+      break
+    if out_of_time():
+      # only a cut if restarts are left
+      truncated = iterations < iter_num
+      break
+    if iterations < min_iter:
+      continue
+    if patience > 0 and no_gain >= patience:
+      break
+    if time_limit is not None and time.time() - start_time >= time_limit:
+      break
+  if verbose:
+    print >> sys.stderr, "Iterations run:", iterations
+    if truncated:
+      print >> sys.stderr, "Stopped by the time budget"
+    print >> sys.stderr, "Memo hits:", memo.hits, "misses:", memo.misses
+  record_stats(stats, memo, iterations, truncated=truncated)
   return (best_match, best_match_num)
 
+
+restart_pool = None  # (jobs, pool) of the restart workers of this process
+worker_climber = None  # (key, Climber) of the latest pair in a restart worker
+climber_keys = count()
+
+
+def get_restart_pool(jobs):
+  """Return a pool of jobs restart worker processes. The pool is started on
+     first use and kept for the get_fh calls of later AMR pairs, until
+     close_restart_pool is called."""
+  global restart_pool
+  if restart_pool is not None and restart_pool[0] != jobs:
+    close_restart_pool()
+  if restart_pool is None:
+    import multiprocessing
+    restart_pool = (jobs, multiprocessing.Pool(jobs))
+  return restart_pool[1]
+
+
+def close_restart_pool():
+  """Stop the restart worker processes, if any were started"""
+  global restart_pool
+  if restart_pool is not None:
+    restart_pool[1].terminate()
+    restart_pool[1].join()
+    restart_pool = None
+
+
+def run_restart_worker(task):
+  """Climb from a start match in a restart worker process. The Climber of an
+     AMR pair is unpickled once per worker, and its memo kept for the later
+     restarts of the pair.
+     Returns:
+         (match number, match, memo hits, memo misses) of the climb"""
+  global worker_climber
+  (key, climber_data, start_match) = task
+  if worker_climber is None or worker_climber[0] != key:
+    worker_climber = (key, pickle.loads(climber_data))
+  climber = worker_climber[1]
+  (hits, misses) = (climber.memo.hits, climber.memo.misses)
+  (match_num, match) = climber.climb(start_match)
+  return (match_num, match, climber.memo.hits - hits,
+          climber.memo.misses - misses)
+
+
+def parallel_climbs(start_matches, climber, jobs):
+  """Run hill-climbing restarts in the restart worker pool.
+     The climber is pickled once and sent with each start match; at most jobs
+     restarts are queued at a time, so if the caller stops early, only the
+     restarts already running are left to finish. The memo hits and misses of
+     the workers are added to those of climber.
+     Args:
+         start_matches: iterable of initial variable mappings
+         climber: Climber of the AMR pair
+         jobs: number of worker processes
+     Returns:
+         generator of (match number, match) at a local optimum, in the order
+         of start_matches"""
+  pool = get_restart_pool(jobs)
+  key = (os.getpid(), next(climber_keys))
+  climber_data = pickle.dumps(climber, 2)
+  pending = deque()
+
+  def finish(result):
+    (match_num, match, hits, misses) = result.get()
+    climber.memo.hits += hits
+    climber.memo.misses += misses
+    return (match_num, match)
+  for start_match in start_matches:
+    pending.append(pool.apply_async(run_restart_worker,
+                                    ((key, climber_data, start_match),)))
+    if len(pending) >= jobs:
+      yield finish(pending.popleft())
+  while pending:
+    yield finish(pending.popleft())
+
+
+def record_stats(stats, memo, iterations, exact=False, truncated=False):
+  """Copy the search statistics of a get_fh call into the stats dict, if any"""
+  if stats is None:
+    return
+  stats["memo_hits"] = memo.hits
+  stats["memo_misses"] = memo.misses
+  stats["iterations"] = iterations
+  stats["exact"] = exact
+  stats["truncated"] = truncated
+
 # help of inst_list: record a0 location in the test_instance ...
 
 
@@ -627,44 +1743,15 @@ def print_alignment(match, test_instance, gold_instance, flip=False):
       filp: filp the test/gold or not"""
   result = []
   for i, m in enumerate(match):
+    test_node = "%s(%s)" % (test_instance[i][1], test_instance[i][2])
     if m == -1:
-      if not flip:
-        result.append(
-            test_instance[i][1] +
-            "(" +
-            test_instance[i][2] +
-            ")" +
-            "-Null")
-      else:
-        result.append(
-            "Null-" +
-            test_instance[i][1] +
-            "(" +
-            test_instance[i][2] +
-            ")")
+      gold_node = "Null"
     else:
-      if not flip:
-        result.append(
-            test_instance[i][1] +
-            "(" +
-            test_instance[i][2] +
-            ")" +
-            "-" +
-            gold_instance[m][1] +
-            "(" +
-            gold_instance[m][2] +
-            ")")
-      else:
-        result.append(
-            gold_instance[m][1] +
-            "(" +
-            gold_instance[m][2] +
-            ")" +
-            "-" +
-            test_instance[i][1] +
-            "(" +
-            test_instance[i][2] +
-            ")")
+      gold_node = "%s(%s)" % (gold_instance[m][1], gold_instance[m][2])
+    if not flip:
+      result.append(test_node + "-" + gold_node)
+    else:
+      result.append(gold_node + "-" + test_node)
   return " ".join(result)
 
 
@@ -693,13 +1780,136 @@ def compute_f(match_num, test_num, gold_num):
     return (precision, recall, 0.00)
 
 
+def read_amrs(input_f, cache=False):
+  """Read and parse the AMRs of a file.
+     Args:
+         input_f: open AMR file
+         cache: read the parsed AMRs from the amr_cache file of input_f,
+                building it first if needed
+     Returns:
+         generator of AMRs, None for those that did not parse"""
+  if cache:
+    records = amr_cache.load_amrs(input_f.name)
+    try:
+      for (parsed, comments) in records:
+        yield parsed
+    finally:
+      records.close()
+    return
+  while True:
+    cur_amr = get_amr_line(input_f)
+    if cur_amr == "":
+      break
+    yield amr.AMR.parse_AMR_line(cur_amr)
+
+
+def read_amr_pairs(file1, file2, cache=False):
+  """Read and parse the AMRs of two files in lockstep.
+     Args:
+         file1: file containing AMR 1 of each pair
+         file2: file containing AMR 2 of each pair
+         cache: read the parsed AMRs from amr_cache files (see read_amrs)
+     Returns:
+         generator of ((instance, relation1, relation2) triples of AMR 1,
+                       (instance, relation1, relation2) triples of AMR 2),
+         with variables as indices (AMR.get_indexed_triples)"""
+  end = object()  # fills in for the AMRs of the shorter file
+  for (amr1, amr2) in izip_longest(read_amrs(file1, cache),
+                                   read_amrs(file2, cache), fillvalue=end):
+    if amr1 is end:
+      print >> sys.stderr, "Error: File 1 has less AMRs than file 2"
+      print >> sys.stderr, "Ignoring remaining AMRs"
+      break
+    if amr2 is end:
+      print >> sys.stderr, "Error: File 2 has less AMRs than file 1"
+      print >> sys.stderr, "Ignoring remaining AMRs"
+      break
+    yield (amr1.get_indexed_triples(), amr2.get_indexed_triples())
+
+
+def score_amr_pair(pair):
+  """Compute the best match of one AMR pair.
+     Args:
+         pair: (sentence number, triples of AMR 1, triples of AMR 2), with the
+             triples as yielded by read_amr_pairs
+     Returns:
+         (best match number, triple number of AMR 1, triple number of AMR 2,
+          get_fh search statistics)"""
+  (sent_num,
+   (test_inst, test_rel1, test_rel2),
+   (gold_inst, gold_rel1, gold_rel2)) = pair
+  # read_amr_pairs gives indexed variables, so there is no prefix
+  test_label = None
+  gold_label = None
+  stats = {}
+  if verbose:
+    print "AMR pair", sent_num
+    print >> sys.stderr, "Instance triples of AMR 1:", len(test_inst)
+    print >> sys.stderr, test_inst
+#   print >> sys.stderr,"Relation triples of AMR 1:",len(test_rel)
+    print >> sys.stderr, "Relation triples of AMR 1:", len(
+        test_rel1) + len(test_rel2)
+    print >>sys.stderr, test_rel1
+    print >> sys.stderr, test_rel2
+#   print >> sys.stderr, test_rel
+    print >> sys.stderr, "Instance triples of AMR 2:", len(gold_inst)
+    print >> sys.stderr, gold_inst
+#   print >> sys.stderr,"Relation triples of file 2:",len(gold_rel)
+    print >> sys.stderr, "Relation triples of AMR 2:", len(
+        gold_rel1) + len(gold_rel2)
+    #print >> sys.stderr,"Relation triples of file 2:",len(gold_rel1)+len(gold_rel2)
+    print >> sys.stderr, gold_rel1
+    print >> sys.stderr, gold_rel2
+#    print >> sys.stderr, gold_rel
+  if len(test_inst) < len(gold_inst):
+    (best_match,
+     best_match_num) = get_fh(test_inst,
+                              test_rel1,
+                              test_rel2,
+                              gold_inst,
+                              gold_rel1,
+                              gold_rel2,
+                              test_label,
+                              gold_label,
+                              stats=stats,
+                              **pair_options)
+    if verbose:
+      print >> sys.stderr, "AMR pair ", sent_num
+      print >> sys.stderr, "best match number", best_match_num
+      print >> sys.stderr, "best match", best_match
+      print >>sys.stderr, "Best Match:", print_alignment(
+          best_match, test_inst, gold_inst)
+  else:
+    (best_match,
+     best_match_num) = get_fh(gold_inst,
+                              gold_rel1,
+                              gold_rel2,
+                              test_inst,
+                              test_rel1,
+                              test_rel2,
+                              gold_label,
+                              test_label,
+                              stats=stats,
+                              **pair_options)
+    if verbose:
+      print >> sys.stderr, "Sent ", sent_num
+      print >> sys.stderr, "best match number", best_match_num
+      print >> sys.stderr, "best match", best_match
+      print >>sys.stderr, "Best Match:", print_alignment(
+          best_match, gold_inst, test_inst, True)
+  return (best_match_num,
+          len(test_rel1) + len(test_rel2) + len(test_inst),
+          len(gold_rel1) + len(gold_rel2) + len(gold_inst),
+          stats)
+
+
 def main(args):
   """Main function of the smatch calculation program"""
   global verbose
   global iter_num
   global single_score
   global pr_flag
-  global match_num_dict
+  global pair_options
   # set the restart number
   iter_num = args.r + 1
   verbose = False
@@ -709,102 +1919,62 @@ def main(args):
     verbose = True
   if args.pr:
     pr_flag = True
+  if args.jobs > 1 and args.restart_jobs > 1:
+    print >> ERROR_LOG, "Error: --jobs and --restart_jobs cannot both be above 1"
+    return
+  pair_options = {"iter_num": iter_num,
+                  "backend": args.backend,
+                  "search": args.search,
+                  "memo_size": args.memo_size,
+                  "jobs": args.restart_jobs,
+                  "exact_limit": args.exact_limit,
+                  "patience": args.patience,
+                  "min_iter": args.min_restarts + 1,
+                  "time_limit": args.restart_time,
+                  "time_budget": args.time_budget,
+                  "init": args.init,
+                  "max_evals": args.max_evals}
+  # with an adaptive restart policy, report the iterations of each pair
+  show_iterations = args.patience > 0 or args.restart_time is not None
   total_match_num = 0
   total_test_num = 0
   total_gold_num = 0
   sent_num = 1
-  while True:
-    cur_amr1 = get_amr_line(args.f[0])
-    cur_amr2 = get_amr_line(args.f[1])
-    if cur_amr1 == "" and cur_amr2 == "":
-      break
-    if(cur_amr1 == ""):
-      print >> sys.stderr, "Error: File 1 has less AMRs than file 2"
-      print >> sys.stderr, "Ignoring remaining AMRs"
-      break
-    # print >> sys.stderr, "AMR 1 is empty"
-      # continue
-    if(cur_amr2 == ""):
-      print >> sys.stderr, "Error: File 2 has less AMRs than file 1"
-      print >> sys.stderr, "Ignoring remaining AMRs"
-      break
-    # print >> sys.stderr, "AMR 2 is empty"
-    # continue
-    amr1 = amr.AMR.parse_AMR_line(cur_amr1)
-    amr2 = amr.AMR.parse_AMR_line(cur_amr2)
-    test_label = "a"
-    gold_label = "b"
-    amr1.rename_node(test_label)
-    amr2.rename_node(gold_label)
-    (test_inst, test_rel1, test_rel2) = amr1.get_triples2()
-    (gold_inst, gold_rel1, gold_rel2) = amr2.get_triples2()
-    if verbose:
-      print "AMR pair", sent_num
-      print >> sys.stderr, "Instance triples of AMR 1:", len(test_inst)
-      print >> sys.stderr, test_inst
-  #   print >> sys.stderr,"Relation triples of AMR 1:",len(test_rel)
-      print >> sys.stderr, "Relation triples of AMR 1:", len(
-          test_rel1) + len(test_rel2)
-      print >>sys.stderr, test_rel1
-      print >> sys.stderr, test_rel2
-  #   print >> sys.stderr, test_rel
-      print >> sys.stderr, "Instance triples of AMR 2:", len(gold_inst)
-      print >> sys.stderr, gold_inst
-  #   print >> sys.stderr,"Relation triples of file 2:",len(gold_rel)
-      print >> sys.stderr, "Relation triples of AMR 2:", len(
-          gold_rel1) + len(gold_rel2)
-      #print >> sys.stderr,"Relation triples of file 2:",len(gold_rel1)+len(gold_rel2)
-      print >> sys.stderr, gold_rel1
-      print >> sys.stderr, gold_rel2
-  #    print >> sys.stderr, gold_rel
-    if len(test_inst) < len(gold_inst):
-      (best_match,
-       best_match_num) = get_fh(test_inst,
-                                test_rel1,
-                                test_rel2,
-                                gold_inst,
-                                gold_rel1,
-                                gold_rel2,
-                                test_label,
-                                gold_label)
-      if verbose:
-        print >> sys.stderr, "AMR pair ", sent_num
-        print >> sys.stderr, "best match number", best_match_num
-        print >> sys.stderr, "best match", best_match
-        print >>sys.stderr, "Best Match:", print_alignment(
-            best_match, test_inst, gold_inst)
-    else:
-      (best_match,
-       best_match_num) = get_fh(gold_inst,
-                                gold_rel1,
-                                gold_rel2,
-                                test_inst,
-                                test_rel1,
-                                test_rel2,
-                                gold_label,
-                                test_label)
-      if verbose:
-        print >> sys.stderr, "Sent ", sent_num
-        print >> sys.stderr, "best match number", best_match_num
-        print >> sys.stderr, "best match", best_match
-        print >>sys.stderr, "Best Match:", print_alignment(
-            best_match, gold_inst, test_inst, True)
+  pairs = ((sent_num, test_triples, gold_triples)
+           for (sent_num, (test_triples, gold_triples))
+           in enumerate(read_amr_pairs(args.f[0], args.f[1], args.cache), 1))
+  pool = None
+  if args.jobs > 1:
+    import multiprocessing
+    # workers are forked here and inherit the options set above; results
+    # come back in input order
+    pool = multiprocessing.Pool(args.jobs)
+    scores = pool.imap(score_amr_pair, pairs, JOB_BATCH_SIZE)
+  else:
+    scores = (score_amr_pair(pair) for pair in pairs)
+  for (best_match_num, test_num, gold_num, stats) in scores:
+    if stats["truncated"]:
+      print >> ERROR_LOG, "Warning: AMR pair", sent_num, "ran out of its time budget"
     if not single_score:
       (precision,
        recall,
-       best_f_score) = compute_f(best_match_num,
-                                 len(test_rel1) + len(test_inst) + len(test_rel2),
-                                 len(gold_rel1) + len(gold_inst) + len(gold_rel2))
+       best_f_score) = compute_f(best_match_num, test_num, gold_num)
       print "Sentence", sent_num
       if pr_flag:
         print "Precision: %.2f" % precision
         print "Recall: %.2f" % recall
       print "Smatch score: %.2f" % best_f_score
+      if show_iterations:
+        print "Iterations: %d" % stats["iterations"]
     total_match_num += best_match_num
-    total_test_num += len(test_rel1) + len(test_rel2) + len(test_inst)
-    total_gold_num += len(gold_rel1) + len(gold_rel2) + len(gold_inst)
-    match_num_dict.clear()
+    total_test_num += test_num
+    total_gold_num += gold_num
     sent_num += 1  # print "F-score:",best_f_score
+  if pool is not None:
+    pool.close()
+    pool.join()
+  close_restart_pool()
+  amr.reset_tables()
   if verbose:
     print >> sys.stderr, "Total match num"
     print >> sys.stderr, total_match_num, total_test_num, total_gold_num
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+"""
+weight_array.py
+
+Array-backed candidate pool for smatch. Instead of the dict-of-dicts
+weight_dict built by smatch.compute_pool, the weights are kept in NumPy arrays:
+
+  unary: (test_len, gold_len + 1) matrix of instance/attribute weights for
+    mapping test variable i to gold variable j. The extra last column stands
+    for "unmatched" (-1) and is always zero.
+  rel_i, rel_j, rel_k, rel_l, rel_w: sparse (COO) list of relation weights.
+    Entry e says that mapping i -> j together with k -> l gains rel_w[e].
+    Every entry is stored in both directions, as in weight_dict.
+
+Requires numpy.
+"""
+
+import numpy as np
+
+from amr import LABELS
+
+EPSILON = 1e-9  # gains below this are float noise from summing weights
+
+
+class WeightArrays(object):
+  def __init__(self, unary, candidates, rel_i, rel_j, rel_k, rel_l, rel_w):
+    self.unary = unary
+    self.candidates = candidates  # (test_len, gold_len) bool matrix
+    (self.test_len, self.gold_len) = candidates.shape
+    self.rel_i = rel_i
+    self.rel_j = rel_j
+    self.rel_k = rel_k
+    self.rel_l = rel_l
+    self.rel_w = rel_w
+
+  def match_array(self, match):
+    """ Match list as an index array, with -1 mapped to the padding column """
+    m = np.asarray(match, dtype=np.intp)
+    return np.where(m < 0, self.gold_len, m)
+
+  def match_num(self, match):
+    """ Number of matching triples under the match (cf. smatch.compute_match) """
+    m = self.match_array(match)
+    total = self.unary[np.arange(self.test_len), m].sum()
+    if len(self.rel_w):
+      live = (m[self.rel_i] == self.rel_j) & (m[self.rel_k] == self.rel_l)
+      # each relation is stored in both directions
+      total += self.rel_w[live].sum() / 2.0
+    return float(total)
+
+  def contributions(self, m):
+    """
+    (test_len, gold_len + 1) matrix of the weight test variable i would get by
+    mapping to gold variable j, given where match array m maps the others.
+    """
+    shape = (self.test_len, self.gold_len + 1)
+    score = self.unary.copy()
+    if len(self.rel_w):
+      live = m[self.rel_k] == self.rel_l
+      score += np.bincount(self.rel_i[live] * shape[1] + self.rel_j[live],
+                           weights=self.rel_w[live],
+                           minlength=shape[0] * shape[1]).reshape(shape)
+    return score
+
+  def swap_corrections(self, m):
+    """
+    (test_len, test_len) matrix of relation weights that contributions() gets
+    wrong for a swap of i and j, because it assumes the other one stays put.
+    """
+    n = self.test_len
+    (p, q, r, s, w) = (self.rel_i, self.rel_j, self.rel_k, self.rel_l, self.rel_w)
+    (mp, mr) = (m[p], m[r])
+    # add the new (i, m[j])-(j, m[i]) pair and the old pair, which the two
+    # current scores subtract twice; drop pairs that assume j or i stays put
+    w = w * (((q == mr) & (s == mp)).astype(np.float64) +
+             ((q == mp) & (s == mr)) -
+             ((q == mr) & (s == mr)) -
+             ((q == mp) & (s == mp)))
+    return np.bincount(p * n + r, weights=w, minlength=n * n).reshape((n, n))
+
+  def estimate_matrix(self):
+    """
+    (test_len, gold_len) matrix of the estimates of smatch.estimate_weights,
+    zero outside the candidates.
+    """
+    score = self.unary[:, :self.gold_len].copy()
+    if len(self.rel_w):
+      # total weight of each (i, j)-(k, l) pair, then the best one of (i, j)
+      # towards each other test variable k
+      key = (self.rel_i * self.gold_len + self.rel_j) * self.test_len + self.rel_k
+      (pairs, inverse) = np.unique(key * self.gold_len + self.rel_l,
+                                   return_inverse=True)
+      pair_w = np.bincount(inverse, weights=self.rel_w)
+      (keys, inverse) = np.unique(pairs // self.gold_len, return_inverse=True)
+      best = np.zeros(len(keys))
+      np.maximum.at(best, inverse, pair_w)
+      score += np.bincount(keys // self.test_len, weights=best,
+                           minlength=score.size).reshape(score.shape) / 2.0
+    return np.where(self.candidates, np.maximum(score, 0), 0)
+
+  def estimate_weights(self):
+    """ Estimates in the dict format of smatch.estimate_weights """
+    score = self.estimate_matrix()
+    return dict(((int(i), int(j)), float(score[i, j]))
+                for (i, j) in zip(*np.nonzero(self.candidates)))
+
+  def upper_bound(self):
+    """ Upper bound on the match number, as smatch.match_upper_bound """
+    if self.test_len == 0 or self.gold_len == 0:
+      return 0.0
+    score = self.estimate_matrix()
+    return float(min(score.max(axis=1).sum(), score.max(axis=0).sum()))
+
+  def candidate_match(self):
+    """ Candidate list in the list-of-sets format of smatch.compute_pool """
+    return [set(np.nonzero(row)[0].tolist()) for row in self.candidates]
+
+  def to_dict(self):
+    """ Equivalent weight_dict, for code that expects the dict format """
+    weight_dict = {}
+    for (i, j) in zip(*np.nonzero(self.unary[:, :self.gold_len])):
+      weight_dict[(int(i), int(j))] = {-1: float(self.unary[i, j])}
+    for e in range(len(self.rel_w)):
+      k1 = (int(self.rel_i[e]), int(self.rel_j[e]))
+      k2 = (int(self.rel_k[e]), int(self.rel_l[e]))
+      if k1 not in weight_dict:
+        weight_dict[k1] = {-1: 0.0}
+      weight_dict[k1][k2] = weight_dict[k1].get(k2, 0.0) + float(self.rel_w[e])
+    return weight_dict
+
+
+def intern_labels(labels, table):
+  """ Map each label to a small integer id, adding new labels to table """
+  return np.array([table.setdefault(l, len(table)) for l in labels],
+                  dtype=np.intp)
+
+
+def label_id_array(labels):
+  """ amr.LABELS ids of the labels, equal for labels equal up to case """
+  return np.array([LABELS.label_id(l) for l in labels], dtype=np.intp)
+
+
+def label_weight_matrix(test_labels, gold_labels, weight_fn):
+  """
+  Weights between test and gold labels as a (len(test), len(gold)) matrix.
+  Weight functions flagged with case_insensitive (exact match on lowercased
+  labels, as smatch.dflt_label_weighter) are evaluated with a single array
+  comparison of amr.LABELS ids. Other functions are called once per distinct label pair, or
+  only for pairs of the same label class if they declare a label_class.
+  """
+  if getattr(weight_fn, 'case_insensitive', False):
+    test_ids = label_id_array(test_labels)
+    gold_ids = label_id_array(gold_labels)
+    return (test_ids[:, None] == gold_ids[None, :]).astype(np.float64)
+  test_table = {}
+  gold_table = {}
+  test_ids = intern_labels(test_labels, test_table)
+  gold_ids = intern_labels(gold_labels, gold_table)
+  distinct = np.zeros((len(test_table), len(gold_table)))
+  label_class = getattr(weight_fn, 'label_class', lambda label: None)
+  gold_classes = {}
+  for (g, gi) in gold_table.items():
+    gold_classes.setdefault(label_class(g), []).append((g, gi))
+  for (t, ti) in test_table.items():
+    for (g, gi) in gold_classes.get(label_class(t), ()):
+      distinct[ti, gi] = weight_fn(t, g)
+  return distinct[test_ids][:, gold_ids]
+
+
+def var_indices(triples, pos, label):
+  """
+  Variable numbers at position pos of each triple, e.g. a3 -> 3, or the
+  variables themselves if label is None (see smatch.index_vars)
+  """
+  if label is None:
+    return np.array([t[pos] for t in triples], dtype=np.intp)
+  return np.array([int(t[pos][len(label):]) for t in triples], dtype=np.intp)
+
+
+def compute_pool_array(test_instance, test_relation1, test_relation2,
+    gold_instance, gold_relation1, gold_relation2,
+    test_label, gold_label,
+    node_weight_fn, edge_weight_fn):
+  """
+  Array-backed counterpart of smatch.compute_pool, with the same arguments.
+  Returns:
+    candidate_match: a list of candidate mapping variables. Each entry contains a set of the variables the variable can map to.
+    weights: a WeightArrays holding the unary and relation weights.
+  """
+  test_len = len(test_instance)
+  gold_len = len(gold_instance)
+  candidates = np.zeros((test_len, gold_len), dtype=bool)
+  unary = np.zeros((test_len, gold_len + 1))
+
+  # instance and one-variable relation triples contribute unary weights
+  # wherever the relation names agree
+  for (test_triples, gold_triples) in ((test_instance, gold_instance),
+                                       (test_relation1, gold_relation1)):
+    if len(test_triples) == 0 or len(gold_triples) == 0:
+      continue
+    test_names = label_id_array([t[0] for t in test_triples])
+    gold_names = label_id_array([t[0] for t in gold_triples])
+    same_name = test_names[:, None] == gold_names[None, :]
+    w = label_weight_matrix([t[2] for t in test_triples],
+                            [t[2] for t in gold_triples], node_weight_fn)
+    test_vars = var_indices(test_triples, 1, test_label)
+    gold_vars = var_indices(gold_triples, 1, gold_label)
+    (ti, gi) = np.nonzero(same_name)
+    candidates[test_vars[ti], gold_vars[gi]] = True
+    flat = test_vars[ti] * (gold_len + 1) + gold_vars[gi]
+    unary += np.bincount(flat, weights=w[ti, gi],
+                         minlength=test_len * (gold_len + 1)).reshape(unary.shape)
+
+  rel = [np.zeros(0, dtype=np.intp) for x in range(4)] + [np.zeros(0)]
+  if len(test_relation2) and len(gold_relation2):
+    w = label_weight_matrix([t[0] for t in test_relation2],
+                            [t[0] for t in gold_relation2], edge_weight_fn)
+    (ti, gi) = np.nonzero(w > 0)
+    w = w[ti, gi]
+    i = var_indices(test_relation2, 1, test_label)[ti]
+    k = var_indices(test_relation2, 2, test_label)[ti]
+    j = var_indices(gold_relation2, 1, gold_label)[gi]
+    l = var_indices(gold_relation2, 2, gold_label)[gi]
+    candidates[i, j] = True
+    candidates[k, l] = True
+    # cycle: both ends map to the same pair, so the weight is unary
+    cycle = (i == k) & (j == l)
+    unary += np.bincount(i[cycle] * (gold_len + 1) + j[cycle], weights=w[cycle],
+                         minlength=test_len * (gold_len + 1)).reshape(unary.shape)
+    # a test self-loop mapped to two different gold variables can never match
+    keep = i != k
+    (i, j, k, l, w) = (i[keep], j[keep], k[keep], l[keep], w[keep])
+    rel = [np.concatenate((i, k)), np.concatenate((j, l)),
+           np.concatenate((k, i)), np.concatenate((l, j)),
+           np.concatenate((w, w))]
+
+  weights = WeightArrays(unary, candidates, *rel)
+  return (weights.candidate_match(), weights)
+
+
+def get_best_gain_array(match, weights, start_match_num):
+  """
+  Array counterpart of smatch.get_best_gain: evaluates every move and every
+  swap at once and applies the best one.
+  Args:
+    match: the initial variable mapping
+    weights: WeightArrays from compute_pool_array
+    start_match_num: the initial match number
+  Returns:
+    (match number after the step, new match)
+  """
+  m = weights.match_array(match)
+  score = weights.contributions(m)
+  current = score[np.arange(weights.test_len), m]
+
+  # move: remap i to a gold variable nobody maps to
+  unmatched = np.ones(weights.gold_len, dtype=bool)
+  unmatched[m[m < weights.gold_len]] = False
+  move = np.where(weights.candidates & unmatched[None, :],
+                  score[:, :weights.gold_len] - current[:, None], -np.inf)
+  # swap: exchange the gold variables of i and j
+  cross = score[:, m]
+  swap = cross + cross.T - current[:, None] - current[None, :] + \
+         weights.swap_corrections(m)
+  np.fill_diagonal(swap, -np.inf)
+
+  cur_match = list(match)
+  best_move = np.unravel_index(np.argmax(move), move.shape) if move.size else None
+  best_swap = np.unravel_index(np.argmax(swap), swap.shape) if swap.size else None
+  move_gain = move[best_move] if best_move else -np.inf
+  swap_gain = swap[best_swap] if best_swap else -np.inf
+  if max(move_gain, swap_gain) <= EPSILON:
+    return (start_match_num, cur_match)
+  if move_gain >= swap_gain:
+    cur_match[best_move[0]] = int(best_move[1])
+  else:
+    (i, j) = best_swap
+    (cur_match[i], cur_match[j]) = (cur_match[j], cur_match[i])
+  return (weights.match_num(cur_match), cur_match)
@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+"""
+test_amr_parser.py
+
+Differential tests of AMR.parse_AMR_line against the character-by-character
+parser it replaced: both must give identical AMRs, in both consts_to_vars
+modes, on sample AMRs, on generated and mangled AMRs, and on the AMR files
+listed in the AMR_SAMPLE_FILES environment variable (separated like PATH).
+Malformed lines are pinned to the outcome of the reference parser: None
+(after an error message on stderr), a partial AMR, or an exception.
+
+  python -m unittest discover tests
+"""
+
+from collections import defaultdict
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'smatch'))
+import amr
+import amr_cache
+
+
+def char_parse_AMR_line(line, consts_to_vars=False):
+  """The character-by-character parser that AMR.parse_AMR_line replaced,
+  kept as it was as the reference of the differential tests"""
+  # set consts_to_vars True if you want consts represented as variable nodes with
+  # instance labels
+  # significant symbol just encountered: 1 for (, 2 for :, 3 for /
+  state = -1
+  stack = []  # variable stack
+  cur_charseq = []  # current processing char sequence
+  var_dict = {}  # key: var name value: var value
+  var_list = []  # variable name list (order: occurence of the variable
+  # key: var name:  value: list of (attribute name, other variable)
+  var_attr_dict1 = defaultdict(list)
+  # key:var name, value: list of (attribute name, const value)
+  var_attr_dict2 = defaultdict(list)
+  cur_attr_name = ""  # current attribute name
+  attr_list = []  # each entry is an attr dict
+  in_quote = False
+  curr_path = ['0']
+  path2label = {}
+  path_lookup = {}  # (var, reln, const) to path key
+
+  def remove_from_paths(path):
+    """ Adjust all paths in path2label by removing the node at path
+        (and any descdendants) """
+    node_ind = int(path[-1])
+    depth = len(path) - 1
+    prefix = '.'.join(path[:-1]) + '.'
+    # remove node from path2label keys
+    new_path2label = {}
+    for (k, v) in path2label.items():
+      if k.startswith(prefix):
+        k_arr = k.split('.')
+        curr_ind = int(k_arr[depth])
+        if curr_ind == node_ind:
+          continue  # deleting node
+        elif curr_ind > node_ind:
+          # node index moves down by 1 since middle node removed
+          k_arr[depth] = str(curr_ind - 1)
+          new_path2label['.'.join(k_arr)] = v
+          continue
+      new_path2label[k] = v
+    return new_path2label
+
+    # remove node from path_lookup vals
+    for (k, v) in path_lookup.items():
+      if v[:depth] == path[:depth]:
+        curr_ind = int(v[depth])
+        if curr_ind == node_ind:
+          del path_lookup[k]
+        if curr_ind > node_ind:
+          v[depth] = str(curr_ind - 1)
+
+  for i, c in enumerate(line.strip()):
+    if c == " ":
+      if in_quote:
+        cur_charseq.append('_')
+        continue
+      if state == 2:
+        cur_charseq.append(c)
+      continue
+    elif c == "\"":
+      if in_quote:
+        in_quote = False
+      else:
+        in_quote = True
+    elif c == "(":
+      if in_quote:
+        continue
+      if state == 2:
+        if cur_attr_name != "":
+          print >> sys.stderr, "Format error when processing ", line[0:i + 1]
+          return None
+        cur_attr_name = "".join(cur_charseq).strip()
+        cur_charseq[:] = []
+      state = 1
+    elif c == ":":
+      if in_quote:
+        continue
+      if state == 3:  # (...:
+        var_value = "".join(cur_charseq)
+        cur_charseq[:] = []
+        cur_var_name = stack[-1]
+        var_dict[cur_var_name] = var_value
+        path2label['.'.join(curr_path)] = var_value
+        curr_path.append('0')
+      elif state == 2:  # : ...:
+        temp_attr_value = "".join(cur_charseq)
+        cur_charseq[:] = []
+        parts = temp_attr_value.split()
+        if len(parts) < 2:
+          print >> sys.stderr, "Error in processing", line[0:i + 1]
+          return None
+        attr_name = parts[0].strip()
+        attr_value = parts[1].strip()
+        if len(stack) == 0:
+          print >> sys.stderr, "Error in processing", line[
+              :i], attr_name, attr_value
+          return None
+        # TODO should all labels in quotes be consts?
+        if attr_value not in var_dict:
+          var_attr_dict2[stack[-1]].append((attr_name, attr_value))
+          path2label['.'.join(curr_path)] = attr_value
+          path_lookup[
+              (stack[-1], attr_name, attr_value)] = [i for i in curr_path]
+          curr_path[-1] = str(int(curr_path[-1]) + 1)
+        else:
+          var_attr_dict1[stack[-1]].append((attr_name, attr_value))
+      else:
+        curr_path[-1] = str(int(curr_path[-1]) + 1)
+      state = 2
+    elif c == "/":
+      if in_quote:
+        continue
+      if state == 1:
+        variable_name = "".join(cur_charseq)
+        cur_charseq[:] = []
+        if variable_name in var_dict:
+          print >> sys.stderr, "Duplicate variable ", variable_name, " in parsing AMR"
+          return None
+        stack.append(variable_name)
+        var_list.append(variable_name)
+        if cur_attr_name != "":
+          if not cur_attr_name.endswith("-of"):
+            var_attr_dict1[stack[-2]].append((cur_attr_name, variable_name))
+          else:
+            var_attr_dict1[variable_name].append(
+                (cur_attr_name[:-3], stack[-2]))
+          cur_attr_name = ""
+      else:
+        print >> sys.stderr, "Error in parsing AMR", line[0:i + 1]
+        return None
+      state = 3
+    elif c == ")":
+      if in_quote:
+        continue
+      if len(stack) == 0:
+        print >> sys.stderr, "Unmatched parathesis at position", i, "in processing", line[
+            0:i + 1]
+        return None
+      if state == 2:
+        temp_attr_value = "".join(cur_charseq)
+        cur_charseq[:] = []
+        parts = temp_attr_value.split()
+        if len(parts) < 2:
+          print >> sys.stderr, "Error processing", line[
+              :i + 1], temp_attr_value
+          return None
+        attr_name = parts[0].strip()
+        attr_value = parts[1].strip()
+        if cur_attr_name.endswith("-of"):
+          var_attr_dict1[variable_name].append(
+              (cur_attr_name[:-3], stack[-2]))
+        elif attr_value not in var_dict:
+          var_attr_dict2[stack[-1]].append((attr_name, attr_value))
+        else:
+          var_attr_dict1[stack[-1]].append((attr_name, attr_value))
+        path2label['.'.join(curr_path)] = attr_value
+        path_lookup[
+            (stack[-1], attr_name, attr_value)] = [i for i in curr_path]
+        curr_path.pop()
+      elif state == 3:
+        var_value = "".join(cur_charseq)
+        cur_charseq[:] = []
+        cur_var_name = stack[-1]
+        var_dict[cur_var_name] = var_value
+        path2label['.'.join(curr_path)] = var_value
+      else:
+        curr_path.pop()
+      stack.pop()
+      cur_attr_name = ""
+      state = 4
+    else:
+      cur_charseq.append(c)
+  # create var_list, link_list, attribute
+  # keep original variable name.
+  var_value_list = []
+  link_list = []
+  const_attr_list = []  # for monolingual mode
+
+  # consts_to_vars mode variables
+  const_cnt = 0
+  const_var_list = []
+  const_var_value_list = []
+  const_link_list = []
+
+  for v in var_list:
+    if v not in var_dict:
+      print >> sys.stderr, "Error: variable value not found", v
+      return None
+    else:
+      var_value_list.append(var_dict[v])
+    link_dict = {}
+    const_dict = {}
+    if v in var_attr_dict1:
+      for v1 in var_attr_dict1[v]:
+        link_dict[v1[1]] = v1[0]
+    if v in var_attr_dict2:
+      for v2 in var_attr_dict2[v]:
+        const_lbl = v2[1]
+        if v2[1][0] == "\"" and v2[1][-1] == "\"":
+          const_lbl = v2[1][1:-1]
+        elif v2[1] in var_dict:
+          # not the first occurrence of this child var
+          link_dict[v2[1]] = v2[0]
+          path2label = remove_from_paths(path_lookup[(v, v2[0], v2[1])])
+          continue
+
+        if consts_to_vars:
+          const_var = '_CONST_%d' % const_cnt
+          const_cnt += 1
+          var_dict[const_var] = const_lbl
+          const_var_list.append(const_var)
+          const_var_value_list.append(const_lbl)
+          const_link_list.append({})
+          link_dict[const_var] = v2[0]
+        else:
+          const_dict[v2[0]] = const_lbl
+
+    link_list.append(link_dict)
+    if not consts_to_vars:
+      const_attr_list.append(const_dict)
+    link_list[0][var_list[0]] = "TOP"
+  if consts_to_vars:
+    var_list += const_var_list
+    var_value_list += const_var_value_list
+    link_list += const_link_list
+    const_attr_list = [{} for v in var_list]
+  result_amr = amr.AMR(
+      var_list,
+      var_value_list,
+      link_list,
+      const_attr_list,
+      path2label)
+  return result_amr
+
+
+SAMPLE_AMRS = [
+  """(t / take-10
+       :ARG0 (i / it)
+       :ARG1 (l2 / long
+               :polarity -))""",
+  """(w / want-01
+       :ARG0 (b / boy)
+       :ARG1 (g / go-02
+               :ARG0 b))""",
+  """(p / person :wiki "Barack_Obama"
+       :name (n / name :op1 "Barack" :op2 "Obama")
+       :ARG0-of (h / have-org-role-91
+                  :ARG2 (p2 / president)))""",
+  """(s / say-01
+       :ARG0 (c / country :name (n / name :op1 "New" :op2 "York"))
+       :ARG1 (a / and
+               :op1 (r / run-01 :ARG0 c :time (d / date-entity :year 2012))
+               :op2 (e / eat-01 :ARG0 c :ARG1 (f / food) :manner r))
+       :time (d2 / date-entity :month 3 :day 14))""",
+  """(m / mean-01 :ARG1 (t / thing :mod "a (quoted) phrase: with / marks")
+       :domain m)""",
+  """(d / dog :ARG1-of (b / big-01) :mod (t / this) :quant 2 :polarity -
+       :ARG0-of (r / run-01 :location (h / house :poss d)))""",
+]
+
+# (line, outcome of both parsers): None, an exception class, or the nodes,
+# var_values and path2label of the AMR
+MALFORMED_AMRS = [
+  ('(a / b :c)', None),  # relation without a value
+  ('(a / b :c d :e)', None),
+  ('(t / time :a: time -)', None),
+  ('(x1a: b)', None),  # no concept
+  ('(a :c d)', None),
+  (')', None),  # unmatched bracket
+  ('(a / b :c (a / d))', None),  # duplicate variable
+  ('(a / b :c d', (['a'], ['b'], {'0': 'b'})),  # unclosed: the last relation is dropped
+  ('(a / b :c "d e)', (['a'], ['b'], {'0': 'b'})),  # unclosed quote runs to the end
+  ('(a / b)(c / d)', (['a', 'c'], ['b', 'd'], {'0': 'd'})),
+  ('(x / "a b" :c d)', (['x'], ['a_b'], {'0': 'a_b', '0.0': 'd'})),
+  ('x', ([], [], {})),
+  (':a b', ([], [], {})),
+  (':("q r"/(x1a: b)b:time x1', IndexError),  # relation outside any bracket
+]
+
+CONCEPTS = ['want-01', 'boy', 'girl', 'go-02', 'city', 'name', 'and', 'Dog',
+            'dog', 'say-01', 'thing']
+RELATIONS = ['ARG0', 'ARG1', 'ARG2', 'mod', 'op1', 'op2', 'time', 'ARG0-of',
+             'ARG1-of', 'domain']
+CONSTANTS = ['-', '+', '1', '2012', '"New York"', '"Obama"', 'expressive']
+
+
+def random_amr(rng, size):
+  """ Random AMR line of at most size variables, with constants, quoted
+  strings, inverse relations and re-entrancies """
+  names = []
+
+  def node(depth):
+    var = 'v%d' % len(names)
+    names.append(var)
+    text = '(%s / %s' % (var, rng.choice(CONCEPTS))
+    for k in range(rng.randint(0, 3) if depth < 5 else 0):
+      r = rng.random()
+      if r < 0.15:
+        text += ' :%s %s' % (rng.choice(RELATIONS), rng.choice(names))
+      elif r < 0.4 or len(names) >= size:
+        text += ' :%s %s' % (rng.choice(RELATIONS), rng.choice(CONSTANTS))
+      else:
+        text += ' :%s %s' % (rng.choice(RELATIONS), node(depth + 1))
+    return text + ')'
+  return node(0)
+
+
+def mangle(rng, line):
+  """ line with a few characters deleted or inserted """
+  for k in range(rng.randint(1, 3)):
+    p = rng.randrange(len(line) + 1)
+    if rng.random() < 0.4:
+      line = line[:p] + line[p + 1:]
+    else:
+      line = line[:p] + rng.choice('():/" -a1') + line[p:]
+  return line
+
+
+def outcome(parse, line, consts_to_vars):
+  """ Comparable result of a parser: the AMR fields, None, or the class of
+  the exception raised """
+  stderr = sys.stderr
+  sys.stderr = open(os.devnull, 'w')
+  try:
+    parsed = parse(line, consts_to_vars=consts_to_vars)
+  except Exception as e:
+    return e.__class__
+  finally:
+    sys.stderr.close()
+    sys.stderr = stderr
+  if parsed is None:
+    return None
+  return (parsed.nodes, parsed.var_values, list(parsed.link_src),
+          list(parsed.link_tgt), parsed.link_label, list(parsed.const_src),
+          parsed.const_label, parsed.const_value, parsed.paths,
+          parsed.path_labels)
+
+
+class ParserDifferentialTest(unittest.TestCase):
+
+  def assertSameParse(self, line):
+    for consts_to_vars in (False, True):
+      self.assertEqual(outcome(amr.AMR.parse_AMR_line, line, consts_to_vars),
+                       outcome(char_parse_AMR_line, line, consts_to_vars),
+                       'parsers differ on %r (consts_to_vars=%s)' %
+                       (line, consts_to_vars))
+
+  def test_samples(self):
+    for text in SAMPLE_AMRS:
+      line = ''.join(l.strip() for l in text.split('\n'))
+      self.assertNotEqual(amr.AMR.parse_AMR_line(line), None)
+      self.assertSameParse(line)
+
+  def test_generated(self):
+    rng = random.Random(17)
+    for k in range(1000):
+      line = random_amr(rng, rng.randint(1, 15))
+      self.assertSameParse(line)
+      self.assertSameParse(mangle(rng, line))
+
+  def test_malformed(self):
+    for (line, expected) in MALFORMED_AMRS:
+      self.assertSameParse(line)
+      result = outcome(amr.AMR.parse_AMR_line, line, False)
+      if expected is None or isinstance(expected, type):
+        self.assertEqual(result, expected, line)
+      else:
+        parsed = amr.AMR.parse_AMR_line(line)
+        self.assertEqual((parsed.nodes, parsed.var_values,
+                          dict(parsed.path2label.items())), expected, line)
+
+  def test_sample_files(self):
+    paths = [p for p in os.environ.get('AMR_SAMPLE_FILES', '').split(os.pathsep) if p]
+    if not paths:
+      self.skipTest('AMR_SAMPLE_FILES is not set')
+    for path in paths:
+      with open(path) as f:
+        while True:
+          (line, comments) = amr_cache.get_amr_entry(f)
+          if line == '':
+            break
+          self.assertSameParse(line)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+"""
+test_smatch_search.py
+
+Tests of the smatch alignment search: the match number each search reports
+must be the one compute_match gives for the match it returns, and never above
+the upper bound. Randomized tests on small generated pairs also check the
+array pool against the dict pool, and the exact search and the searches with
+a big enough exact_limit against a brute force search over every match.
+
+  python -m unittest discover tests
+"""
+
+import itertools
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'smatch'))
+import amr
+import smatch
+
+
+def fractional_node_weighter(test_label, gold_label):
+  """ Cross-language style node weights: some weight for any label pair """
+  return 1.0 if test_label == gold_label else 0.5
+
+
+def xlang_edge_weighter(test_label, gold_label):
+  """ Edge weights as the cross-language aligner gives them: op edges are
+  nearly equivalent """
+  (test_label, gold_label) = (test_label.lower(), gold_label.lower())
+  if test_label == gold_label:
+    return 1.0
+  if test_label.startswith("op") and gold_label.startswith("op"):
+    return 0.9
+  return 0.0
+xlang_edge_weighter.label_class = \
+    lambda label: "op" if label.lower().startswith("op") else label.lower()
+
+WEIGHTERS = [(smatch.dflt_label_weighter, smatch.dflt_label_weighter),
+             (fractional_node_weighter, xlang_edge_weighter)]
+
+CONCEPTS = ["want-01", "Want-01", "boy", "girl"]
+ATTRIBUTES = ["polarity", "quant"]
+CONSTANTS = ["-", "1", "2"]
+RELATIONS = ["ARG0", "arg0", "ARG1", "op1", "op2", "TOP"]
+
+
+def random_triples(rng, num_vars):
+  """ Random indexed triples (see AMR.get_indexed_triples), with self-loops
+  and repeated relations """
+  instance = [("instance", v, rng.choice(CONCEPTS)) for v in range(num_vars)]
+  relation1 = [(rng.choice(ATTRIBUTES), rng.randrange(num_vars),
+                rng.choice(CONSTANTS)) for x in range(rng.randint(0, num_vars))]
+  relation2 = [(rng.choice(RELATIONS), rng.randrange(num_vars),
+                rng.randrange(num_vars))
+               for x in range(rng.randint(0, 2 * num_vars))]
+  return (instance, relation1, relation2)
+
+
+def injective_matches(test_len, gold_len):
+  """ Every match of test_len variables into gold_len variables or none """
+  gold_vars = range(gold_len) + [-1] * test_len
+  seen = set()
+  for match in itertools.permutations(gold_vars, test_len):
+    if match not in seen:
+      seen.add(match)
+      yield list(match)
+
+
+class SelfLoopTest(unittest.TestCase):
+  """ A test self-loop against a gold relation between two variables gives
+  weight_dict pairs (i, j)-(i, l), which no match can satisfy """
+
+  def setUp(self):
+    test = amr.AMR.parse_AMR_line(
+        '(v0 / name :op1 (v1 / boy :domain v1 :ARG1 v1))', True)
+    gold = amr.AMR.parse_AMR_line(
+        '(w / want-01 :ARG0 (n / name) :ARG1 (s / say-01))', True)
+    self.triples = test.get_indexed_triples() + gold.get_indexed_triples()
+    self.weighters = (fractional_node_weighter, smatch.dflt_label_weighter)
+    (self.candidate_match, self.weight_dict) = smatch.compute_pool(
+        *(self.triples + (None, None) + self.weighters))
+    self.test_len = len(self.triples[0])
+    self.gold_len = len(self.triples[3])
+    self.upper_bound = smatch.match_upper_bound(
+        self.weight_dict, self.test_len, self.gold_len)
+
+  def test_gains(self):
+    for match in injective_matches(self.test_len, self.gold_len):
+      match_num = smatch.compute_match(match, self.weight_dict)
+      for (i, m) in enumerate(match):
+        for nm in range(self.gold_len):
+          if nm in match:
+            continue
+          new_match = match[:]
+          new_match[i] = nm
+          gain = smatch.move_gain(match, i, m, nm, self.weight_dict, match_num)
+          self.assertAlmostEqual(
+              match_num + gain, smatch.compute_match(new_match, self.weight_dict))
+        for j in range(i + 1, self.test_len):
+          new_match = match[:]
+          (new_match[i], new_match[j]) = (match[j], m)
+          gain = smatch.swap_gain(match, i, m, j, match[j], self.weight_dict,
+                                  match_num)
+          self.assertAlmostEqual(
+              match_num + gain, smatch.compute_match(new_match, self.weight_dict))
+
+  def test_searches(self):
+    for search in sorted(smatch.SEARCH_ENGINES):
+      for exact_limit in (0, smatch.EXACT_LIMIT):
+        # the time budget keeps a climber that cycles on a wrong gain finite
+        (match, match_num) = smatch.get_fh(
+            *self.triples, test_label=None, gold_label=None,
+            node_weight_fn=self.weighters[0], edge_weight_fn=self.weighters[1],
+            iter_num=20, search=search, exact_limit=exact_limit, time_budget=5)
+        self.assertAlmostEqual(
+            match_num, smatch.compute_match(match, self.weight_dict))
+        self.assertLessEqual(match_num, self.upper_bound + smatch.EPSILON)
+
+
+class TimeBudgetTest(unittest.TestCase):
+
+  def test_truncated(self):
+    # the upper bound (5.5) is out of reach, so only the time budget, which
+    # has run out, stops the search; that cuts it short only if it skips
+    # restarts
+    test = amr.AMR.parse_AMR_line('(a / x :ARG0 (b / y) :ARG1 (c / y))')
+    gold = amr.AMR.parse_AMR_line('(d / x :ARG0 (e / y :ARG1 (f / y)))')
+    triples = test.get_indexed_triples() + gold.get_indexed_triples()
+    for iter_num in (1, 5):
+      stats = {}
+      smatch.get_fh(*triples, test_label=None, gold_label=None,
+                    iter_num=iter_num, exact_limit=0, time_budget=0,
+                    stats=stats)
+      self.assertEqual(stats['truncated'], iter_num > 1)
+
+
+class RandomPairTest(unittest.TestCase):
+  """ Cross-checks on random pairs of up to four variables each """
+
+  TRIALS = 60
+
+  def pairs(self):
+    rng = random.Random(13)
+    for trial in range(self.TRIALS):
+      triples = random_triples(rng, rng.randint(1, 4)) + \
+          random_triples(rng, rng.randint(1, 4))
+      for weighters in WEIGHTERS:
+        yield (triples, weighters)
+
+  def pool(self, triples, weighters):
+    return smatch.compute_pool(*(triples + (None, None) + weighters))
+
+  def best_match_num(self, weight_dict, test_len, gold_len):
+    return max(smatch.compute_match(match, weight_dict)
+               for match in injective_matches(test_len, gold_len))
+
+  def assertValidMatch(self, match, candidate_match):
+    matched = [m for m in match if m != -1]
+    self.assertEqual(len(matched), len(set(matched)))
+    for (i, m) in enumerate(match):
+      self.assertTrue(m == -1 or m in candidate_match[i])
+
+  @unittest.skipIf(smatch.weight_array is None, "the array pool needs numpy")
+  def test_array_pool(self):
+    for (triples, weighters) in self.pairs():
+      (candidate_match, weight_dict) = self.pool(triples, weighters)
+      (array_candidates, weights) = smatch.weight_array.compute_pool_array(
+          *(triples + (None, None) + weighters))
+      self.assertEqual(array_candidates, candidate_match)
+      (test_len, gold_len) = (len(triples[0]), len(triples[3]))
+      self.assertAlmostEqual(
+          weights.upper_bound(),
+          smatch.match_upper_bound(weight_dict, test_len, gold_len))
+      estimates = smatch.estimate_weights(weight_dict)
+      array_estimates = weights.estimate_weights()
+      for pair in set(estimates) | set(array_estimates):
+        self.assertAlmostEqual(array_estimates.get(pair, 0),
+                               estimates.get(pair, 0))
+      array_dict = weights.to_dict()
+      for match in injective_matches(test_len, gold_len):
+        match_num = smatch.compute_match(match, weight_dict)
+        self.assertAlmostEqual(weights.match_num(match), match_num)
+        self.assertAlmostEqual(smatch.compute_match(match, array_dict),
+                               match_num)
+
+  def test_exact_match(self):
+    for (triples, weighters) in self.pairs():
+      (candidate_match, weight_dict) = self.pool(triples, weighters)
+      (test_len, gold_len) = (len(triples[0]), len(triples[3]))
+      best = self.best_match_num(weight_dict, test_len, gold_len)
+      self.assertLessEqual(
+          best, smatch.match_upper_bound(weight_dict, test_len, gold_len) +
+          smatch.EPSILON)
+      start = [-1] * test_len
+      (match_num, match) = smatch.exact_match(candidate_match, weight_dict,
+                                              start, 0)
+      self.assertValidMatch(match, candidate_match)
+      self.assertAlmostEqual(match_num, best)
+      self.assertAlmostEqual(smatch.compute_match(match, weight_dict), best)
+
+  def test_hungarian_init(self):
+    for (triples, weighters) in self.pairs():
+      (candidate_match, weight_dict) = self.pool(triples, weighters)
+      match = smatch.assignment_match(
+          candidate_match, smatch.estimate_weights(weight_dict),
+          len(triples[3]))
+      self.assertValidMatch(match, candidate_match)
+
+  def test_searches(self):
+    options = [dict(search=search, init=init)
+               for search in sorted(smatch.SEARCH_ENGINES)
+               for init in ("greedy", "hungarian")]
+    if smatch.weight_array is not None:
+      options.append(dict(backend="array"))
+    for (triples, weighters) in self.pairs():
+      (candidate_match, weight_dict) = self.pool(triples, weighters)
+      (test_len, gold_len) = (len(triples[0]), len(triples[3]))
+      best = self.best_match_num(weight_dict, test_len, gold_len)
+      for opts in options:
+        for exact_limit in (0, smatch.EXACT_LIMIT):
+          stats = {}
+          # the time budget keeps a climber that cycles on a wrong gain finite
+          (match, match_num) = smatch.get_fh(
+              *triples, test_label=None, gold_label=None,
+              node_weight_fn=weighters[0], edge_weight_fn=weighters[1],
+              iter_num=3, exact_limit=exact_limit, max_evals=200,
+              time_budget=5, stats=stats, **opts)
+          self.assertValidMatch(match, candidate_match)
+          self.assertAlmostEqual(
+              match_num, smatch.compute_match(match, weight_dict))
+          self.assertLessEqual(match_num, best + smatch.EPSILON)
+          if stats["exact"]:
+            self.assertAlmostEqual(match_num, best)
+          if exact_limit:
+            self.assertTrue(stats["exact"])
+
+
+class ResetTablesTest(unittest.TestCase):
+
+  def score(self, test, gold):
+    triples = test.get_indexed_triples() + gold.get_indexed_triples()
+    return smatch.get_fh(*triples, test_label=None, gold_label=None)[1]
+
+  def test_reset(self):
+    lines = ['(w / want-01 :ARG0 (b / boy) :ARG1 (g / go-01 :ARG0 b))',
+             '(w / WANT-01 :ARG0 (b / boy) :ARG1 (g / go-02 :ARG0 b))']
+    (test, gold) = [amr.AMR.parse_AMR_line(line) for line in lines]
+    match_num = self.score(test, gold)
+    amr.reset_tables()
+    self.assertEqual(len(amr.LABELS.ids), 0)
+    self.assertEqual(len(amr.PATH_TUPLES), 0)
+    self.assertTrue(smatch.label_ids is amr.LABELS.ids)
+    # AMRs parsed before and after the reset still compare the same
+    self.assertEqual(self.score(test, gold), match_num)
+    self.assertEqual(self.score(test, amr.AMR.parse_AMR_line(lines[1])),
+                     match_num)
+
+
+if __name__ == '__main__':
+  unittest.main()